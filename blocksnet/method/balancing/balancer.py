@@ -14,44 +14,52 @@ from scipy.optimize import minimize
 from blocksnet.utils.measurement_units import HECTARE_IN_SQUARE_METERS
 
 
-def kindergarten_area_ranges(children_number: int) -> tuple[float, int]:
-    children_number = ceil(children_number)
+KINDERGARTEN_RANGES = ([140, 180, 250, 281], [(0.72, 180), (1.44, 250), (1.1, 280)])
+"""Upper bounds of the kids numbers and areas with capacities of the kindergartens serving them"""
+SCHOOL_RANGES = ([100, 250, 300, 600, 800, 1101], [(1.2, 250), (1.1, 300), (1.3, 600), (1.5, 800), (1.8, 1100)])
+"""Upper bounds of the schoolkids numbers and areas with capacities of the schools serving them"""
 
-    conditions = [
-        140 < children_number <= 180,
-        180 < children_number <= 250,
-        250 < children_number <= 281,
-    ]
 
-    choices = [(0.72, 180), (1.44, 250), (1.1, 280)]
-    return tuple(np.select(conditions, choices, default=(0, 0)))
+def _area_ranges(number, ranges: tuple[list, list]) -> tuple[np.ndarray, np.ndarray]:
+    """Get area and capacity of the facility serving the number of people within one of the ranges"""
+    bounds, choices = ranges
+    areas, capacities = np.array([(0, 0), *choices, (0, 0)], dtype=float).T
+    # a number within (bounds[i - 1], bounds[i]] is served by the i-th facility
+    index = np.searchsorted(bounds, np.ceil(number), side="left")
+    return areas[index], capacities[index]
 
 
-def kindergarten_area(children_number) -> tuple[float, int]:
-    if children_number >= 280:
-        return tuple(map(sum, zip(kindergarten_area_ranges(280), kindergarten_area(children_number - 280))))
-    return kindergarten_area_ranges(children_number)
+def _area(number, ranges: tuple[list, list], step: int) -> tuple[float | np.ndarray, float | np.ndarray]:
+    """Get area and capacity of the facilities serving the number of people, each step is served by one facility"""
+    number = np.asarray(number, dtype=float)
+    # steps are subtracted while the number is not less than the step, the rest is served by one more facility
+    rest = np.where(number > 0, np.fmod(number, step), number)
+    steps = (number - rest) / step
+    step_area, step_capacity = _area_ranges(step, ranges)
+    area, capacity = _area_ranges(rest, ranges)
+    # the steps areas are added one by one to keep the sums exactly the same as when served step by step
+    for i in range(int(steps.max(initial=0))):
+        area = np.where(steps > i, step_area + area, area)
+        capacity = np.where(steps > i, step_capacity + capacity, capacity)
+    return area[()], capacity[()]
 
 
-def school_area_ranges(schoolkids: int) -> tuple[float, int]:
-    schoolkids = ceil(schoolkids)
+def kindergarten_area_ranges(children_number) -> tuple[float | np.ndarray, float | np.ndarray]:
+    area, capacity = _area_ranges(np.asarray(children_number, dtype=float), KINDERGARTEN_RANGES)
+    return area[()], capacity[()]
+
+
+def kindergarten_area(children_number) -> tuple[float | np.ndarray, float | np.ndarray]:
+    return _area(children_number, KINDERGARTEN_RANGES, 280)
 
-    conditions = [
-        100 < schoolkids <= 250,
-        250 < schoolkids <= 300,
-        300 < schoolkids <= 600,
-        600 < schoolkids <= 800,
-        800 < schoolkids <= 1101,
-    ]
 
-    choices = [(1.2, 250), (1.1, 300), (1.3, 600), (1.5, 800), (1.8, 1100)]
-    return tuple(np.select(conditions, choices, default=(0, 0)))
+def school_area_ranges(schoolkids) -> tuple[float | np.ndarray, float | np.ndarray]:
+    area, capacity = _area_ranges(np.asarray(schoolkids, dtype=float), SCHOOL_RANGES)
+    return area[()], capacity[()]
 
 
-def school_area(schoolkids) -> tuple[float, int]:
-    if schoolkids >= 1100:
-        return tuple(map(sum, zip(school_area_ranges(1100), school_area(schoolkids - 1100))))
-    return school_area_ranges(schoolkids)
+def school_area(schoolkids) -> tuple[float | np.ndarray, float | np.ndarray]:
+    return _area(schoolkids, SCHOOL_RANGES, 1100)
 
 
 def balance_data(gdf, polygon, services_prov):  # pylint: disable=too-many-arguments
@@ -152,6 +160,8 @@ class MasterPlan:  # pylint: disable=too-many-instance-attributes,invalid-name
         self.LA_coef = 0.7
         self.IA_coef = 0.3
 
+        self.eps = np.sqrt(np.finfo(float).eps)  # step of the jacobians approximation
+
         self.F_max = 9
         self.b_min, self.b_max = 18 / HECTARE_IN_SQUARE_METERS, 30 / HECTARE_IN_SQUARE_METERS
         self.G_min, self.G_max = 6 / HECTARE_IN_SQUARE_METERS, 12 / HECTARE_IN_SQUARE_METERS
@@ -207,33 +217,48 @@ class MasterPlan:  # pylint: disable=too-many-instance-attributes,invalid-name
             - self.parking2_area(x[0])
         )
 
-    def bnds_and_cons(self):
-        self.cons = (
-            {"type": "ineq", "fun": lambda x: self.max_population - x[0]},
-            {
-                "type": "ineq",
-                "fun": lambda x: self.max_living_area - self.living_area(x[0], x[1]) - self.parking1_area(x[0]),
-            },
-            {
-                "type": "ineq",
-                "fun": lambda x: self.max_free_area
+    def cons_fun(self, x):
+        """Values of the inequality constraints, which are nonnegative for the feasible parameters"""
+        return np.array(
+            [
+                self.max_population - x[0],
+                self.max_living_area - self.living_area(x[0], x[1]) - self.parking1_area(x[0]),
+                self.max_free_area
                 - self.green_area(x[0] + self.current_unprov_green_population, x[2])
                 - self.op_area(x[0]),
-            },
-            {
-                "type": "ineq",
-                "fun": lambda x: self.max_industrial_area
+                self.max_industrial_area
                 - self.sc_area(x[0] + self.current_unprov_schoolkids)
                 - self.kg_area(x[0] + self.current_unprov_kids)
                 - self.parking2_area(x[0]),
-            },
-            {"type": "ineq", "fun": self.fun},
+                self.fun(x),
+            ]
         )
 
+    def fun_jac(self, x):
+        return self._approx_jac(self.fun, x)
+
+    def cons_jac(self, x):
+        return self._approx_jac(self.cons_fun, x)
+
+    def _approx_jac(self, function, x):
+        """
+        Approximate the jacobian with forward differences the same way as SLSQP does, but with the function
+        evaluated once on the batch of the point and the shifted points.
+        """
+        x = np.asarray(x, dtype=float)
+        upper = np.array(self.bnds, dtype=float)[:, 1]
+        # the step is reversed if it violates the upper bound
+        step = np.where(x + self.eps > upper, -self.eps, self.eps)
+        points = np.column_stack([x, x[:, np.newaxis] + np.diag(step)])
+        values = function(points)
+        return (values[..., 1:] - values[..., :1]) / (np.diag(points[:, 1:]) - x)
+
+    def bnds_and_cons(self):
+        self.cons = ({"type": "ineq", "fun": self.cons_fun, "jac": self.cons_jac},)
+
         self.bnds = ((0, self.max_population), (self.b_min, self.b_max), (self.G_min, self.G_max))
 
     def make_x0s(self):
-
         self.x0s = [
             (0, 0, 0),
             (1 / self.max_population, self.b_min, self.G_min),
@@ -251,7 +276,19 @@ class MasterPlan:  # pylint: disable=too-many-instance-attributes,invalid-name
         results: list[pd.DataFrame] = []
         for x0 in self.x0s:
             results.append(
-                pd.DataFrame([minimize(self.fun, x0, method="SLSQP", bounds=self.bnds, constraints=self.cons)])
+                pd.DataFrame(
+                    [
+                        minimize(
+                            self.fun,
+                            x0,
+                            method="SLSQP",
+                            jac=self.fun_jac,
+                            bounds=self.bnds,
+                            constraints=self.cons,
+                            options={"eps": self.eps},
+                        )
+                    ]
+                )
             )
         self.results = pd.concat(itertools.chain([self.results], results)).reset_index(drop=True)
 
@@ -261,7 +298,6 @@ class MasterPlan:  # pylint: disable=too-many-instance-attributes,invalid-name
         return self.results["x"][self.results[self.results["fun"] > 0]["fun"].idxmin()]
 
     def recalculate_indicators(self, population, b, G) -> dict:
-
         population = ceil(population)
         green = self.green_area(population + self.current_unprov_green_population, G) + self.current_green_area
         sc = school_area(self.SC_coef * (population + self.current_unprov_schoolkids))
@@ -3,3 +3,4 @@ Provision model is located here.
 """
 from .provision_model import ProvisionModel
 from .lp_provision import LpProvision
+from .provision_session import ProvisionSession
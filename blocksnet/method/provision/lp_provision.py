@@ -1,12 +1,23 @@
-from pydantic import BaseModel
+import shutil
+import tempfile
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Literal
+from pydantic import BaseModel, PrivateAttr, model_validator
 from pulp import *
 from itertools import product
-from ...models import CityModel
+from ...models import AccessibilityMatrix, CityModel
+from .transport_problem import TransportProblem
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 import math
 import pandas as pd
+import geopandas as gpd
+import networkx as nx
 import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
 
 
 class LpProvision(BaseModel):
@@ -23,6 +34,83 @@ class LpProvision(BaseModel):
         "policlinics": {"demand": 27, "accessibility": 15},
     }
     """Service types information about demands per 1000 population and normative assessibilities"""
+    engine: Literal["cbc", "highs", "flow"] = "cbc"
+    """
+    Solver of the transportation problem: `cbc` solves the dense problem over all demand and capacity pairs
+    with PuLP, `highs` solves the sparse problem over accessible pairs only with scipy HiGHS,
+    `flow` solves the same sparse problem as a min-cost flow with the network simplex. `highs` and `flow` give
+    the same provision, which may differ from the `cbc` one: the sparse problem supplies as much demand within
+    accessibility as possible, while `cbc` minimizes the total travel time over all the pairs and only counts
+    the accessible ones as supplied
+    """
+    warm_start: bool = False
+    """
+    Keep the first optimal flow of every service type and re-optimise it for the changed demands and capacities
+    of later calls instead of solving the sparse problem from scratch. Only available for the sparse engines
+    """
+    executor: Literal["thread", "process"] | None = None
+    """
+    Pool to solve the service types of a scenario concurrently, `None` solves them one after another.
+    Process workers load the city model saved to a temporary directory once when the pool is created, sharing
+    the memory-mapped accessibility matrix. Use the provision as a context manager or call `close()` to release
+    the workers, they are also released when the provision is garbage collected
+    """
+    max_workers: int | None = None
+    """Number of the pool workers, `None` for the executor default"""
+    _baselines: dict[str, tuple[tuple, dict]] = PrivateAttr(default_factory=dict)
+    _problems: dict[str, tuple[tuple, TransportProblem]] = PrivateAttr(default_factory=dict)
+    _pool: tuple[tuple, Executor, weakref.finalize] | None = PrivateAttr(None)
+    # baselines and kept flows are extended by the thread workers
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    @model_validator(mode="after")
+    def validate_warm_start(self):
+        assert not self.warm_start or self.engine != "cbc", "Warm start is only available for the sparse engines"
+        return self
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # baselines, kept flows and workers are only valid for the city model and services they were created for
+        if name in self.model_fields:
+            self._baselines = {}
+            self._problems = {}
+            self.close()
+
+    def __enter__(self) -> "LpProvision":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the pool workers of the scenario provisions"""
+        if self._pool is not None:
+            self._pool[2]()
+            self._pool = None
+
+    def _get_pool(self, service_types: list[str]) -> Executor:
+        """Get the pool, recreated if process workers got another state of the city model"""
+        self.city_model.warm(service_types)
+        graphs = [self.city_model.get_service_graph(service_type) for service_type in service_types]
+        key = (self.city_model.accessibility_matrix, self.city_model.blocks, *graphs)
+        if self._pool is not None and self.executor == "process":
+            kept_key = self._pool[0]
+            if len(kept_key) != len(key) or any(a is not b for a, b in zip(kept_key, key)):
+                self.close()
+        if self._pool is None:
+            path = None
+            if self.executor == "thread":
+                executor = ThreadPoolExecutor(self.max_workers)
+            else:
+                # workers load the saved city model once instead of getting its copy, the matrix is memory-mapped
+                path = tempfile.mkdtemp(prefix="blocksnet_")
+                self.city_model.save(path)
+                fields = {"services": self.services, "engine": self.engine, "warm_start": self.warm_start}
+                executor = ProcessPoolExecutor(
+                    self.max_workers, initializer=_init_provision_worker, initargs=(path, fields)
+                )
+            self._pool = (key, executor, weakref.finalize(self, _shutdown_pool, executor, path))
+        return self._pool[1]
 
     @classmethod
     def sum_provision(cls, gdf):
@@ -48,44 +136,248 @@ class LpProvision(BaseModel):
 
     def get_scenario_provisions(self, scenario, updated_blocks={}):
         """Provision assessment for the scenario and updated blocks (optional)"""
-        provisions = {}
+        if self.executor is None:
+            provisions = {service_type: self.get_provision(service_type, updated_blocks) for service_type in scenario}
+        else:
+            pool = self._get_pool(list(scenario))
+            get_provision = self.get_provision if self.executor == "thread" else _get_worker_provision
+            futures = {
+                service_type: pool.submit(get_provision, service_type, updated_blocks) for service_type in scenario
+            }
+            provisions = {service_type: future.result() for service_type, future in futures.items()}
         metric = 0
         for service_type, weight in scenario.items():
-            provision = self.get_provision(service_type, updated_blocks)
-            provisions[service_type] = provision
-            metric += self.sum_provision(provision) * weight
+            metric += self.sum_provision(provisions[service_type]) * weight
         return provisions, np.mean(metric)
 
     def get_provision(self, service_type_name, updated_blocks={}):
         """Provision assessment for certain service type and updated blocks (optional)"""
-        acc_df = self.city_model.accessibility_matrix.df
+        matrix = self.city_model.accessibility_matrix
+        if matrix.is_sparse and self.services[service_type_name]["accessibility"] > matrix.max_time:
+            raise ValueError(f"Accessibility of {service_type_name} exceeds max_time of the sparse matrix")
+        blocks, demand, capacity = self._get_blocks(service_type_name, updated_blocks)
+        # drop 0 demand
+        blocks.drop(labels=list(demand.loc[lambda x: x == 0].index), inplace=True, axis="index")
+        demand = demand.loc[lambda x: x > 0]
+        # drop 0 capacity
+        capacity = capacity.loc[lambda x: x > 0]
+        accessibility = self.services[service_type_name]["accessibility"]
+        if self.warm_start and self._is_kept(service_type_name):
+            supplied = self._resolve(service_type_name, demand, capacity)
+        else:
+            costs = self._get_costs(service_type_name, demand, capacity)
+            if self.engine == "cbc":
+                supplied = self._solve_cbc(demand, capacity, costs, accessibility)
+            else:
+                rows, columns, pairs_costs = self._get_pairs(costs, accessibility)
+                # the kept problem grows with new blocks, so its overflow is costlier than chains between all blocks
+                n_blocks = len(matrix.index) if self.warm_start else min(costs.shape)
+                overflow_cost = self._get_overflow_cost(accessibility, n_blocks)
+                solve = {"highs": self._solve_highs, "flow": self._solve_flow}[self.engine]
+                flow, potentials = solve(demand, capacity, costs, rows, columns, pairs_costs, overflow_cost)
+                supplied = pd.Series(np.bincount(rows, weights=flow, minlength=len(costs.index)), index=costs.index)
+                if self.warm_start:
+                    pairs = pd.DataFrame(
+                        {"row": costs.index[rows], "column": costs.columns[columns], "cost": pairs_costs, "flow": flow}
+                    )
+                    self._keep(service_type_name, demand, capacity, costs, pairs, potentials, overflow_cost)
+        blocks["demand"] = demand
+        blocks["supplied"] = supplied
+        blocks["provision"] = blocks["supplied"] / blocks["demand"]
+        return blocks
+
+    def get_blocks(
+        self, service_type_name: str, updated_blocks: dict = {}
+    ) -> tuple[gpd.GeoDataFrame, pd.Series, pd.Series]:
+        """Get the blocks with the updates along with positive demands and capacities of the service type"""
+        blocks, demand, capacity = self._get_blocks(service_type_name, updated_blocks)
+        return blocks, demand.loc[lambda x: x > 0], capacity.loc[lambda x: x > 0]
+
+    def get_accessible_pairs(self, service_type_name: str, demand: pd.Series, capacity: pd.Series) -> pd.DataFrame:
+        """Get the `row` demand and `column` capacity blocks ids of the pairs within accessibility of the service type"""
+        if len(demand) == 0 or len(capacity) == 0:
+            return pd.DataFrame({"row": demand.index[:0], "column": capacity.index[:0]})
+        costs = self._get_costs(service_type_name, demand, capacity)
+        rows, columns, _ = self._get_pairs(costs, self.services[service_type_name]["accessibility"])
+        return pd.DataFrame({"row": costs.index[rows], "column": costs.columns[columns]})
+
+    def solve(self, service_type_name: str, demand: pd.Series, capacity: pd.Series) -> pd.Series:
+        """
+        Solve the sparse transportation problem of the demand and capacity blocks from scratch and get supplied
+        demand by the demand blocks. Blocks may be any subset of the city blocks, e.g. a group of the blocks
+        connected by accessible pairs, which solution is optimal within the problem of all the blocks as well
+        """
+        if self.engine == "cbc":
+            raise ValueError("Solving the blocks subsets is only available for the sparse engines")
+        if len(demand) == 0 or len(capacity) == 0:
+            return pd.Series(0.0, index=demand.index)
+        costs = self._get_costs(service_type_name, demand, capacity)
+        accessibility = self.services[service_type_name]["accessibility"]
+        rows, columns, pairs_costs = self._get_pairs(costs, accessibility)
+        overflow_cost = self._get_overflow_cost(accessibility, min(costs.shape))
+        solve = {"highs": self._solve_highs, "flow": self._solve_flow}[self.engine]
+        flow, _ = solve(demand, capacity, costs, rows, columns, pairs_costs, overflow_cost)
+        return pd.Series(np.bincount(rows, weights=flow, minlength=len(costs.index)), index=costs.index)
+
+    def _get_blocks(
+        self, service_type_name: str, updated_blocks: dict
+    ) -> tuple[gpd.GeoDataFrame, pd.Series, pd.Series]:
+        """Get the blocks, demands and capacities of the service type with the updated blocks"""
+        baseline = self._get_baseline(service_type_name)
         blocks = self.city_model.blocks.to_gdf()
+        demand = baseline["demand"].copy()
+        capacity = baseline["capacity"].copy()
+        # only the updated blocks are recalculated on top of the baseline
         for block_id, updated_info in updated_blocks.items():
             if "population" in updated_info:
                 blocks.loc[block_id, "current_population"] += updated_info["population"]
-        blocks["demand"] = (blocks["current_population"] / 1000 * self.services[service_type_name]["demand"]).apply(
-            lambda x: math.ceil(x)
-        )
-        costs = pd.DataFrame(
-            data=acc_df
-        )  # .applymap(lambda x : math.exp(x) / self.services[service_type_name]['accessibility'])
-        result = pd.DataFrame(index=costs.index, columns=costs.columns)
-        demand = blocks["demand"]
-        capacity = (
-            pd.DataFrame.from_dict(self.city_model.services_graph.nodes, orient="index").fillna(0)[
-                f"{service_type_name}_capacity"
-            ]
-        ).apply(lambda x: math.ceil(x))
-        for block_id, updated_info in updated_blocks.items():
+                population = blocks.loc[[block_id], "current_population"]
+                demand.loc[block_id] = self._get_demand(population, service_type_name).iloc[0]
             if service_type_name in updated_info:
                 capacity.loc[block_id] += updated_info[service_type_name]
-        # drop 0 demand
-        blocks.drop(labels=list(demand.loc[lambda x: x == 0].index), inplace=True, axis="index")
-        costs.drop(labels=list(demand.loc[lambda x: x == 0].index), inplace=True, axis="index")
-        demand = demand.loc[lambda x: x > 0]
-        # drop 0 capacity
-        costs.drop(labels=capacity.loc[lambda x: x == 0].index, inplace=True, axis="columns")
-        capacity = capacity.loc[lambda x: x > 0]
+        return blocks, demand, capacity
+
+    def _get_demand(self, population: pd.Series, service_type_name: str) -> pd.Series:
+        """Get integer demand of the blocks population for the service type"""
+        return (population / 1000 * self.services[service_type_name]["demand"]).apply(lambda x: math.ceil(x))
+
+    def _get_baseline(self, service_type_name: str) -> dict:
+        """
+        Get demand and capacity of the service type blocks without updates along with travel times between them.
+        The baseline is calculated once for the city model and the service
+        """
+        matrix = self.city_model.accessibility_matrix
+        graph = self.city_model.get_service_graph(service_type_name)
+        key = (matrix, self.city_model.blocks, graph, self.services[service_type_name]["demand"])
+        with self._lock:
+            if service_type_name in self._baselines:
+                kept_key, baseline = self._baselines[service_type_name]
+                if all(a is b for a, b in zip(kept_key[:-1], key[:-1])) and kept_key[-1] == key[-1]:
+                    return baseline
+            population = self.city_model.blocks.to_gdf()["current_population"]
+            demand = self._get_demand(population, service_type_name)
+            capacity = graph.attributes[f"{service_type_name}_capacity"].apply(lambda x: math.ceil(x))
+            baseline = {
+                "demand": demand,
+                "capacity": capacity,
+                "costs": self._get_submatrix(demand.index[demand > 0], capacity.index[capacity > 0]),
+            }
+            self._baselines[service_type_name] = (key, baseline)
+            return baseline
+
+    def _get_submatrix(self, rows: pd.Index, columns: pd.Index) -> pd.DataFrame:
+        """Get travel times between the blocks in the matrix order"""
+        matrix = self.city_model.accessibility_matrix
+        # pairs missing from a sparse matrix are farther than its max_time, so they cost more than any stored one
+        fill_value = 2 * matrix.max_time if matrix.is_sparse else np.inf
+        rows = matrix.index[np.isin(matrix.index, rows)]
+        columns = matrix.index[np.isin(matrix.index, columns)]
+        return pd.DataFrame(matrix.get_submatrix(rows, columns, fill_value), index=rows, columns=columns)
+
+    def _get_costs(self, service_type_name: str, demand: pd.Series, capacity: pd.Series) -> pd.DataFrame:
+        """
+        Get travel times between the demand and capacity blocks in the matrix order, sliced from the baseline.
+        Baseline travel times are extended with the blocks which get demand or capacity with updates
+        """
+        # the extended costs are built aside and published at once, so the other threads read a complete frame
+        with self._lock:
+            baseline = self._get_baseline(service_type_name)
+            costs = baseline["costs"]
+            new_rows = demand.index.difference(costs.index)
+            new_columns = capacity.index.difference(costs.columns)
+            if len(new_rows) > 0 or len(new_columns) > 0:
+                matrix = self.city_model.accessibility_matrix
+                rows = matrix.index[np.isin(matrix.index, costs.index.union(new_rows))]
+                columns = matrix.index[np.isin(matrix.index, costs.columns.union(new_columns))]
+                costs = costs.reindex(index=rows, columns=columns)
+                if len(new_rows) > 0:
+                    new_costs = self._get_submatrix(new_rows, columns)
+                    costs.loc[new_costs.index, :] = new_costs.to_numpy()
+                if len(new_columns) > 0:
+                    new_costs = self._get_submatrix(rows, new_columns)
+                    costs.loc[:, new_costs.columns] = new_costs.to_numpy()
+                baseline["costs"] = costs
+        rows = np.flatnonzero(costs.index.isin(demand.index))
+        columns = np.flatnonzero(costs.columns.isin(capacity.index))
+        return costs.iloc[rows, columns]
+
+    def _get_kept_key(self, service_type_name: str) -> tuple:
+        """Get the objects the kept flow of the service type is valid for"""
+        return (
+            self.city_model.accessibility_matrix,
+            self.city_model.get_service_graph(service_type_name),
+            self.services[service_type_name]["accessibility"],
+        )
+
+    def _is_kept(self, service_type_name: str) -> bool:
+        """Check if the flow of the service type is kept and still valid for the city model and the service"""
+        if service_type_name not in self._problems:
+            return False
+        (matrix, graph, accessibility), _ = self._problems[service_type_name]
+        key = self._get_kept_key(service_type_name)
+        return key[0] is matrix and key[1] is graph and key[2] == accessibility
+
+    def _keep(  # pylint: disable=too-many-arguments
+        self,
+        service_type_name: str,
+        demand: pd.Series,
+        capacity: pd.Series,
+        costs: pd.DataFrame,
+        pairs: pd.DataFrame,
+        potentials: tuple[np.ndarray, np.ndarray] | None,
+        overflow_cost: int,
+    ) -> None:
+        """Keep the optimal flow of the service type solved from scratch"""
+        problem = TransportProblem(overflow_cost)
+        problem.add_blocks(list(costs.index), list(costs.columns), pairs)
+        problem.set_supplies(demand, capacity)
+        problem.set_flow(pairs, potentials)
+        with self._lock:
+            self._problems[service_type_name] = (self._get_kept_key(service_type_name), problem)
+
+    def _resolve(self, service_type_name: str, demand: pd.Series, capacity: pd.Series) -> pd.Series:
+        """Re-optimise the kept flow of the service type for the demands and capacities"""
+        accessibility = self.services[service_type_name]["accessibility"]
+        # the kept problem is only extended under the lock, the copy is solved by the thread alone
+        with self._lock:
+            _, problem = self._problems[service_type_name]
+            new_rows = [i for i in demand.index if i not in problem.rows]
+            new_columns = [i for i in capacity.index if i not in problem.columns]
+            if len(new_rows) > 0 or len(new_columns) > 0:
+                # blocks are added to the kept problem with zero demands and capacities, so its flow stays optimal
+                pairs = self._get_new_pairs(problem, new_rows, new_columns, accessibility)
+                problem.add_blocks(new_rows, new_columns, pairs)
+            problem = problem.copy()
+        problem.set_supplies(demand, capacity)
+        problem.solve()
+        return pd.Series(problem.get_supplied(demand.index), index=demand.index)
+
+    def _get_new_pairs(
+        self, problem: TransportProblem, new_rows: list, new_columns: list, accessibility: float
+    ) -> pd.DataFrame:
+        """Get accessible pairs with the new blocks of the problem and their costs in deciminutes"""
+        matrix = self.city_model.accessibility_matrix
+        pairs = []
+        for rows, columns in ((new_rows, [*problem.columns, *new_columns]), (list(problem.rows), new_columns)):
+            if len(rows) > 0 and len(columns) > 0:
+                costs = pd.DataFrame(matrix.get_submatrix(rows, columns), index=rows, columns=columns)
+                positions, columns_positions, pairs_costs = self._get_pairs(costs, accessibility)
+                pairs.append(
+                    pd.DataFrame(
+                        {
+                            "row": costs.index[positions],
+                            "column": costs.columns[columns_positions],
+                            "cost": pairs_costs,
+                        }
+                    )
+                )
+        return pd.concat(pairs) if pairs else pd.DataFrame({"row": [], "column": [], "cost": []})
+
+    @staticmethod
+    def _solve_cbc(demand: pd.Series, capacity: pd.Series, costs: pd.DataFrame, accessibility: float) -> pd.Series:
+        """Solve the balanced transportation problem over all pairs with CBC and get supplied demand by blocks"""
+        # .applymap(lambda x : math.exp(x) / self.services[service_type_name]['accessibility'])
+        result = pd.DataFrame(index=costs.index, columns=costs.columns)
         # add fictive blocks to balance the problem
         delta = demand.sum() - capacity.sum()
         fictive_index = None
@@ -113,12 +405,115 @@ class LpProvision(BaseModel):
             name = var.name.replace("(", "").replace(")", "").replace(",", "").split("_")
             a = int(name[1])
             b = int(name[2])
-            if value > 0 and costs.loc[a, b] <= self.services[service_type_name]["accessibility"]:
+            if value > 0 and costs.loc[a, b] <= accessibility:
                 if fictive_index != None and a != fictive_index:
                     result.loc[a, b] = value
                 if fictive_column != None and b != fictive_column:
                     result.loc[a, b] = value
-        blocks["demand"] = demand
-        blocks["supplied"] = result.sum(axis=1)
-        blocks["provision"] = blocks["supplied"] / blocks["demand"]
-        return blocks
+        return result.sum(axis=1)
+
+    @staticmethod
+    def _get_pairs(costs: pd.DataFrame, accessibility: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get positions and costs (in deciminutes) of the accessible demand and capacity pairs of the sparse problem"""
+        rows, columns = np.nonzero(costs.to_numpy() <= accessibility)
+        pairs_costs = np.rint(costs.to_numpy()[rows, columns] * AccessibilityMatrix.DECIMINUTES).astype(np.int64)
+        return rows, columns, pairs_costs
+
+    @staticmethod
+    def _get_overflow_cost(accessibility: float, n_blocks: int) -> int:
+        """
+        Get the overflow cost of the sparse problem with reassignments chains not longer than the number of blocks.
+        Overflow costs more than any chain, so supplied demand is maximized first and the total travel time second
+        """
+        return math.ceil(accessibility * AccessibilityMatrix.DECIMINUTES) * (n_blocks + 1) + 1
+
+    @staticmethod
+    def _solve_highs(  # pylint: disable=too-many-arguments
+        demand: pd.Series,
+        capacity: pd.Series,
+        costs: pd.DataFrame,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        pairs_costs: np.ndarray,
+        overflow_cost: int,
+    ) -> tuple[np.ndarray, tuple[np.ndarray, np.ndarray]]:
+        """
+        Solve the transportation problem over accessible pairs only with HiGHS and get the pairs flows along with
+        the potentials of the demand and capacity blocks. Demand which can not be supplied goes to the overflow
+        variable of its block
+        """
+        n_pairs, n_rows = len(rows), len(costs.index)
+        cost = np.concatenate([pairs_costs, np.full(n_rows, overflow_cost)])
+        variables = np.arange(n_pairs + n_rows)
+        # every demand block is supplied by its pairs and its overflow, capacities are the upper bounds
+        a_eq = sp.csr_matrix(
+            (np.ones(n_pairs + n_rows), (np.concatenate([rows, np.arange(n_rows)]), variables)),
+            shape=(n_rows, n_pairs + n_rows),
+        )
+        a_ub = sp.csr_matrix(
+            (np.ones(n_pairs), (columns, variables[:n_pairs])), shape=(len(costs.columns), n_pairs + n_rows)
+        )
+        solution = linprog(
+            cost,
+            A_ub=a_ub,
+            b_ub=capacity.loc[costs.columns].to_numpy(dtype=float),
+            A_eq=a_eq,
+            b_eq=demand.loc[costs.index].to_numpy(dtype=float),
+            bounds=(0, None),
+            method="highs-ipm",
+        )
+        if not solution.success:
+            raise RuntimeError(f"Transportation problem is not solved: {solution.message}")
+        # dual values of the demand and capacity constraints are the potentials of the min-cost flow formulation
+        return solution.x[:n_pairs], (solution.eqlin.marginals, -solution.ineqlin.marginals)
+
+    @staticmethod
+    def _solve_flow(  # pylint: disable=too-many-arguments
+        demand: pd.Series,
+        capacity: pd.Series,
+        costs: pd.DataFrame,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        pairs_costs: np.ndarray,
+        overflow_cost: int,
+    ) -> tuple[np.ndarray, None]:
+        """
+        Solve the transportation problem over accessible pairs only as a min-cost flow and get the pairs flows.
+        Capacities flow to the demand blocks or to the unused node, the overflow node supplies the rest of the demand
+        """
+        demand = demand.loc[costs.index].to_numpy(dtype=np.int64)
+        capacity = capacity.loc[costs.columns].to_numpy(dtype=np.int64)
+        graph = nx.DiGraph()
+        graph.add_nodes_from((("demand", i), {"demand": int(value)}) for i, value in enumerate(demand))
+        graph.add_nodes_from((("capacity", j), {"demand": -int(value)}) for j, value in enumerate(capacity))
+        graph.add_node("overflow", demand=-int(demand.sum()))
+        graph.add_node("unused", demand=int(capacity.sum()))
+        graph.add_weighted_edges_from(
+            ((("capacity", j), ("demand", i), int(cost)) for i, j, cost in zip(rows, columns, pairs_costs))
+        )
+        graph.add_weighted_edges_from((("capacity", j), "unused", 0) for j in range(len(capacity)))
+        graph.add_weighted_edges_from(("overflow", ("demand", i), overflow_cost) for i in range(len(demand)))
+        graph.add_edge("overflow", "unused", weight=0)
+        _, flows = nx.network_simplex(graph)
+        return np.array([flows[("capacity", j)][("demand", i)] for i, j in zip(rows, columns)], dtype=float), None
+
+
+_worker = {}
+"""State of a scenario provisions worker process, sent once per process instead of once per task"""
+
+
+def _init_provision_worker(path: str, fields: dict) -> None:
+    """Initialize a scenario provisions worker process with the city model saved to the directory"""
+    _worker["lp_provision"] = LpProvision(city_model=CityModel.load(path, mmap=True), **fields)
+
+
+def _shutdown_pool(executor: Executor, path: str | None) -> None:
+    """Shut down the scenario provisions workers and remove the city model they have loaded"""
+    executor.shutdown()
+    if path is not None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _get_worker_provision(service_type_name: str, updated_blocks: dict):
+    """Provision assessment for certain service type in a worker process"""
+    return _worker["lp_provision"].get_provision(service_type_name, updated_blocks)
@@ -3,11 +3,22 @@ This module is aimed to provide all necessary tools to get an estimation of prov
 of the selected service
 """
 
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Literal
+
+import geopandas as gpd
+import networkx as nx
 import numpy as np
 import pandas as pd
 from tqdm.auto import tqdm
 
-from blocksnet.models import CityModel
+from blocksnet.models import CityModel, ServicesGraph
+
+from .service_allocation import ServiceAllocation
 
 tqdm.pandas()
 
@@ -21,6 +32,10 @@ class ProvisionModel:
         service_name (str): The name of the service for which the provision is being calculated.
         standard (int): The standard value for the specified service, taken from the `standard_dict` attribute.
         g (int): The value of the `g` attribute.
+        engine (str): `array` assigns whole chunks of demand on arrays, `greedy` assigns it unit by unit on
+            the networkx graph. Both engines give the same provision. `nearest` assigns the demand to the nearest
+            service blocks of all the blocks first, only the service blocks within accessibility (or all of them
+            with overflow) are considered.
     """
 
     standard_dict = {
@@ -69,13 +84,38 @@ class ProvisionModel:
         self,
         city_model: CityModel,
         service_name: str = "schools",
+        engine: Literal["array", "greedy", "nearest"] = "array",
     ):
-        self.blocks = city_model.blocks.to_gdf().copy()
+        self.blocks = city_model.blocks.to_gdf()
         self.service_name = service_name
         self.standard = self.standard_dict[self.service_name]
         self.accessibility = self.services_accessibility_dict[self.service_name]
-        self.graph = city_model.services_graph.copy()
-        self.blocks_aggregated = city_model.blocks.to_gdf().copy()
+        matrix = city_model.accessibility_matrix
+        if matrix.is_sparse and self.accessibility > matrix.max_time:
+            raise ValueError(f"Accessibility of {self.service_name} exceeds max_time of the sparse matrix")
+        self.engine = engine
+        self._services_graph = city_model.get_service_graph(service_name)
+        self._graph = None
+        self.allocation = ServiceAllocation(self._services_graph, service_name)
+        self._is_allocated = False
+        self.blocks_aggregated = city_model.blocks.to_gdf()
+
+    @property
+    def graph(self) -> nx.Graph:
+        """
+        Networkx graph of the city blocks with the provision attributes, created on the first access.
+        With the array engines it is recreated from the allocation after every calculation. Once the graph has been
+        accessed or set, the next calculation takes its state from it, so the changes of the graph are kept
+        """
+        if self._graph is None:
+            self._graph = self._services_graph.to_networkx()
+            if self._is_allocated:
+                self._set_graph_attributes(self._graph)
+        return self._graph
+
+    @graph.setter
+    def graph(self, value: nx.Graph) -> None:
+        self._graph = value
 
     def get_provision(self, overflow: bool = False):  # pylint: disable=too-many-branches,too-many-statements
         """
@@ -86,6 +126,9 @@ class ProvisionModel:
             nx.Graph: A networkx graph representing the city's road network with updated data
             about the provision of the specified service.
         """
+        if self.engine in ("array", "nearest"):
+            self._get_array_provision(overflow)
+            return
 
         graph = self.graph.copy()
         standard = self.standard
@@ -198,6 +241,67 @@ class ProvisionModel:
                 break
         self.graph = graph
 
+    @classmethod
+    def _allocate(cls, allocation: ServiceAllocation, service_name: str, engine: str, overflow: bool) -> None:
+        """Allocate the service type capacities with the array or nearest engine"""
+        scale = 100 if service_name == "recreational_areas" else 1
+        allocate = allocation.allocate if engine == "array" else allocation.allocate_nearest
+        allocate(cls.standard_dict[service_name], cls.services_accessibility_dict[service_name], overflow, scale)
+
+    @classmethod
+    def _get_service_columns(
+        cls, city_model: CityModel, service_name: str, engine: str, overflow: bool
+    ) -> pd.DataFrame:
+        """Provision columns of the service calculated on the read only graph of the city model"""
+        allocation = ServiceAllocation(city_model.get_service_graph(service_name), service_name)
+        cls._allocate(allocation, service_name, engine, overflow)
+        return cls._get_blocks_columns(allocation, service_name)
+
+    @staticmethod
+    def _get_blocks_columns(allocation: ServiceAllocation, service_name: str) -> pd.DataFrame:
+        """Get the provision columns of the blocks from the allocation arrays, only living blocks get the values"""
+        columns = pd.DataFrame(
+            {
+                f"provision_{service_name}": allocation.provision,
+                f"population_prov_{service_name}": allocation.population_prov,
+                f"population_unprov_{service_name}": allocation.population_unprov,
+                f"weakly_prov_{service_name}": allocation.weakly_prov,
+                f"demand_{service_name}": allocation.demand,
+            },
+            index=allocation.nodes,
+        )
+        columns.loc[~allocation.is_living] = 0
+        columns = columns.astype(int)
+        columns[f"provision_{service_name}"] = np.minimum(columns[f"provision_{service_name}"], 100)
+        return columns
+
+    def _get_array_provision(self, overflow: bool = False):
+        """Calculate the provision with the array or nearest engine, the `graph` view is recreated on access"""
+        if self._graph is not None:
+            # the graph may have been changed, so the allocation is rebuilt from its state
+            self._services_graph = ServicesGraph.from_networkx(self._graph)
+            self.allocation = ServiceAllocation(self._services_graph, self.service_name)
+        self._allocate(self.allocation, self.service_name, self.engine, overflow)
+        self._is_allocated = True
+        self._graph = None
+
+    def _set_graph_attributes(self, graph: nx.Graph) -> None:
+        """Set the allocation state to the networkx graph nodes"""
+        allocation = self.allocation
+        nodes = list(graph.nodes)
+        for position in np.flatnonzero(allocation.is_service):
+            graph.nodes[nodes[position]][f"{self.service_name}_capacity"] = allocation.capacity[position]
+        for position in np.flatnonzero(allocation.is_living):
+            graph.nodes[nodes[position]].update(
+                {
+                    f"population_unprov_{self.service_name}": allocation.population_unprov[position],
+                    f"demand_{self.service_name}": allocation.demand[position],
+                    f"weakly_prov_{self.service_name}": allocation.weakly_prov[position],
+                    f"population_prov_{self.service_name}": allocation.population_prov[position],
+                    f"provision_{self.service_name}": allocation.provision[position],
+                }
+            )
+
     def set_blocks_attributes(self) -> pd.DataFrame:
         """
         This function returns a copy of the `blocks` attribute of the object with updated values for the service
@@ -207,55 +311,30 @@ class ProvisionModel:
         Returns:
             DataFrame: A copy of the `blocks` attribute with updated values for the specified service.
         """
-        # standard = self.standard
-        graph = self.graph.copy()
         blocks = self.blocks.copy()
+        if self.engine == "greedy":
+            columns = self._get_graph_columns()
+        else:
+            columns = self._get_blocks_columns(self.allocation, self.service_name)
+            columns["population"] = np.where(self.allocation.is_living, self.allocation.population, 0).astype(int)
+        blocks[columns.columns] = columns.reindex(blocks.index, fill_value=0)
+        return blocks
 
-        new_columns = [
+    def _get_graph_columns(self) -> pd.DataFrame:
+        """Get the provision columns of the blocks from the `graph` nodes, only living blocks get the values"""
+        columns = [
             f"provision_{self.service_name}",
             f"population_prov_{self.service_name}",
             f"population_unprov_{self.service_name}",
             f"weakly_prov_{self.service_name}",
             f"demand_{self.service_name}",
-        ]
-
-        for col in new_columns:
-            blocks[col] = 0
-
-        blocks["population"] = 0
-
-        # Process nodes in the graph
-        for node in graph:
-            if graph.nodes[node]["is_living"]:
-                indx = blocks.index.get_loc(node)
-                node_data = graph.nodes[node]
-
-                for col in new_columns:
-                    if col in node_data:
-                        blocks.at[indx, col] = node_data[col]
-
-                blocks.at[indx, "population"] = node_data["population"]
-
-        int_columns = [
-            f"population_prov_{self.service_name}",
-            f"population_unprov_{self.service_name}",
-            f"weakly_prov_{self.service_name}",
-            f"provision_{self.service_name}",
             "population",
-            f"demand_{self.service_name}",
         ]
-
-        blocks[int_columns] = blocks[int_columns].astype(int)
-
-        blocks[f"provision_{self.service_name}"] = np.minimum(blocks[f"provision_{self.service_name}"], 100)
-
-        # columns_to_keep = ['geometry', 'block_id', f"provision_{self.service_name}",
-        # f"population_prov_{self.service_name}", f"weakly_prov_{self.service_name}",
-        # f"population_unprov_{self.service_name}", f"demand_{self.service_name}", 'population']
-
-        # blocks =  blocks[columns_to_keep]
-
-        return blocks
+        nodes = pd.DataFrame.from_dict(dict(self.graph.nodes(data=True)), orient="index")
+        nodes = nodes.reindex(columns=[*columns, "is_living"]).loc[lambda df: df["is_living"].astype(bool), columns]
+        nodes = nodes.fillna(0).astype(int)
+        nodes[f"provision_{self.service_name}"] = np.minimum(nodes[f"provision_{self.service_name}"], 100)
+        return nodes
 
     def run(self, overflow: bool = False):
         """
@@ -268,3 +347,71 @@ class ProvisionModel:
 
         self.get_provision(overflow=overflow)
         return self.set_blocks_attributes()
+
+    @classmethod
+    def run_all(
+        cls,
+        city_model: CityModel,
+        services: list[str] | None = None,
+        overflow: bool = False,
+        engine: Literal["array", "nearest"] = "array",
+        max_workers: int | None = None,
+    ) -> gpd.GeoDataFrame:
+        """
+        This function calculates the provision of several services in a city at once. Services graphs of the city
+        model are built once and read only, no networkx graphs or blocks copies are created per service.
+        Services are calculated in worker processes, which load the city model saved to a temporary directory once
+        per process, sharing the memory-mapped accessibility matrix and graphs instead of getting their copies.
+
+        Args:
+            city_model (CityModel): City model to calculate the provision for.
+            services (list[str] | None): Names of the services, all the city model services by default.
+            overflow (bool): Whether the demand is weakly provided by the services out of accessibility.
+            engine (str): `array` or `nearest` engine of the provision calculation.
+            max_workers (int | None): Number of the worker processes, `None` for the number of CPUs. With a single
+                worker the services are calculated one after another in the current process.
+
+        Returns:
+            GeoDataFrame: City blocks with the population and the provision columns of all the services.
+        """
+        services = city_model.get_service_types() if services is None else services
+        matrix = city_model.accessibility_matrix
+        for service_name in services:
+            if matrix.is_sparse and cls.services_accessibility_dict[service_name] > matrix.max_time:
+                raise ValueError(f"Accessibility of {service_name} exceeds max_time of the sparse matrix")
+        # graphs are built before the city model is saved, so the workers load them instead of building again
+        city_model.warm(services)
+        get_service_columns = partial(cls._get_service_columns, engine=engine, overflow=overflow)
+        # a single worker would only add the saving and loading of the city model
+        max_workers = min(max_workers or os.cpu_count() or 1, len(services))
+        if max_workers == 1:
+            services_columns = [get_service_columns(city_model, service_name) for service_name in services]
+        else:
+            path = tempfile.mkdtemp(prefix="blocksnet_")
+            try:
+                city_model.save(path)
+                with ProcessPoolExecutor(max_workers, initializer=_init_run_all_worker, initargs=(path,)) as executor:
+                    services_columns = list(executor.map(partial(_get_worker_columns, get_service_columns), services))
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+        blocks = city_model.blocks.to_gdf()
+        columns = pd.concat(services_columns, axis=1).reindex(blocks.index, fill_value=0)
+        attributes = city_model.get_service_graph(services[0]).attributes
+        population = attributes["population"].where(attributes["is_living"], 0)
+        blocks["population"] = population.reindex(blocks.index, fill_value=0).astype(int)
+        blocks[columns.columns] = columns
+        return blocks
+
+
+_worker = {}
+"""State of a `run_all` worker process, the city model is loaded once per process instead of sent per task"""
+
+
+def _init_run_all_worker(path: str) -> None:
+    """Initialize a `run_all` worker process with the city model saved to the directory"""
+    _worker["city_model"] = CityModel.load(path, mmap=True)
+
+
+def _get_worker_columns(get_service_columns, service_name: str) -> pd.DataFrame:
+    """Provision columns of the service calculated in a `run_all` worker process"""
+    return get_service_columns(_worker["city_model"], service_name)
@@ -0,0 +1,172 @@
+"""
+Stateful provision assessment of a service type updated with the blocks edits is located here.
+"""
+import copy
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pydantic import BaseModel, PrivateAttr, model_validator
+from scipy.sparse.csgraph import connected_components
+
+from .lp_provision import LpProvision
+
+
+class ProvisionSession(BaseModel):
+    """
+    Provision assessment of a service type which is kept and updated with the blocks edits.
+
+    Demand blocks are only supplied by the capacity blocks within accessibility, so the sparse transportation
+    problem splits into independent problems of the groups of blocks connected by accessible pairs. An edit changes
+    only the groups of the edited blocks (and the groups they join or split), so only these groups are solved again
+    and the provision of the other blocks is kept.
+
+    The provision is optimal for the blocks with the edits, the same as of `get_provision()`. With tied travel times
+    the optimal supplied demand of a group may be split between its blocks in several ways, so only the totals of
+    the groups are the same as of `get_provision()` then.
+    """
+
+    lp_provision: LpProvision
+    """Provision assessment with a sparse engine, solving the problems of the edited groups"""
+    service_type_name: str
+    """Service type of the assessment"""
+    _updated_blocks: dict = PrivateAttr(default_factory=dict)
+    _blocks: gpd.GeoDataFrame | None = PrivateAttr(None)
+    _demand: pd.Series | None = PrivateAttr(None)
+    _capacity: pd.Series | None = PrivateAttr(None)
+    _pairs: pd.DataFrame | None = PrivateAttr(None)
+    _provision: gpd.GeoDataFrame | None = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def validate_engine(self):
+        assert self.lp_provision.engine != "cbc", "Provision session is only available for the sparse engines"
+        return self
+
+    @property
+    def updated_blocks(self) -> dict:
+        """Accumulated edits of the blocks, the provision is assessed as by `get_provision()` with them"""
+        return copy.deepcopy(self._updated_blocks)
+
+    @property
+    def provision(self) -> gpd.GeoDataFrame:
+        """Current provision of the blocks in the `get_provision()` format"""
+        if self._provision is None:
+            self._start()
+        return self._provision.copy()
+
+    def get_totals(self) -> dict:
+        """Get total demand, supplied demand and provision of the blocks"""
+        if self._provision is None:
+            self._start()
+        return {
+            "demand": self._provision["demand"].sum(),
+            "supplied": self._provision["supplied"].sum(),
+            "provision": LpProvision.sum_provision(self._provision),
+        }
+
+    def reset(self) -> None:
+        """Discard the edits, the provision is assessed again on the next request"""
+        self._updated_blocks = {}
+        self._provision = None
+
+    def edit(self, updated_blocks: dict) -> tuple[gpd.GeoDataFrame, dict]:
+        """
+        Apply the blocks edits and assess the provision of the affected blocks again.
+
+        Attributes
+        ----------
+        updated_blocks: dict
+            Deltas of the blocks population and capacities, e.g. `{block_id: {"population": 100, "schools": 500}}`
+
+        Returns
+        -------
+        changed: gpd.GeoDataFrame
+            Blocks which demand, supplied demand or provision have changed. Blocks without demand after the edits
+            have zero demand and supplied demand
+        totals: dict
+            Total demand, supplied demand and provision of the blocks after the edits
+        """
+        if self._provision is None:
+            self._start()
+        for block_id, updated_info in updated_blocks.items():
+            block_updates = self._updated_blocks.setdefault(block_id, {})
+            for key, value in updated_info.items():
+                block_updates[key] = block_updates.get(key, 0) + value
+        old_demand, old_capacity, old_pairs, old_provision = self._demand, self._capacity, self._pairs, self._provision
+        self._set_blocks()
+        demand, capacity = self._demand, self._capacity
+        # pairs of the blocks which got demand or capacity are added, pairs of the blocks which lost them are dropped
+        new_rows = demand.index.difference(old_demand.index)
+        new_columns = capacity.index.difference(old_capacity.index)
+        kept_pairs = old_pairs[old_pairs["row"].isin(demand.index) & old_pairs["column"].isin(capacity.index)]
+        self._pairs = pd.concat(
+            [
+                kept_pairs,
+                self._get_pairs(demand.loc[new_rows], capacity),
+                self._get_pairs(demand.loc[demand.index.difference(new_rows)], capacity.loc[new_columns]),
+            ],
+            ignore_index=True,
+        )
+        # groups of the edited blocks before and after the edits are solved again
+        rows = demand.index.union(old_demand.index)
+        columns = capacity.index.union(old_capacity.index)
+        pairs = pd.concat([old_pairs, self._pairs])
+        graph = sp.coo_matrix(
+            (
+                np.ones(len(pairs)),
+                (rows.get_indexer(pairs["row"]), len(rows) + columns.get_indexer(pairs["column"])),
+            ),
+            shape=(len(rows) + len(columns),) * 2,
+        )
+        _, labels = connected_components(graph, directed=False)
+        edited = pd.Index(list(updated_blocks))
+        edited_labels = np.union1d(
+            labels[rows.get_indexer(edited[edited.isin(rows)])],
+            labels[len(rows) + columns.get_indexer(edited[edited.isin(columns)])],
+        )
+        affected_rows = rows[np.isin(labels[: len(rows)], edited_labels)]
+        affected_columns = columns[np.isin(labels[len(rows) :], edited_labels)]
+        supplied = old_provision["supplied"].reindex(demand.index)
+        affected_demand = demand.loc[demand.index.isin(affected_rows)]
+        supplied.loc[affected_demand.index] = self._solve(
+            affected_demand, capacity.loc[capacity.index.isin(affected_columns)]
+        )
+        self._set_provision(supplied)
+
+        # blocks without demand are compared as having zero demand and supplied demand
+        index = self._blocks.index[self._blocks.index.isin(demand.index.union(old_demand.index))]
+        old = old_provision[["demand", "supplied"]].reindex(index, fill_value=0)
+        new = self._provision[["demand", "supplied"]].reindex(index, fill_value=0)
+        changed = self._blocks.loc[index[(old != new).any(axis=1).to_numpy()]].copy()
+        changed[["demand", "supplied"]] = new.loc[changed.index]
+        changed["provision"] = changed["supplied"] / changed["demand"]
+        return changed, self.get_totals()
+
+    def _start(self) -> None:
+        """Assess the provision of all the blocks with the accumulated edits"""
+        self._set_blocks()
+        self._pairs = self._get_pairs(self._demand, self._capacity)
+        self._set_provision(self._solve(self._demand, self._capacity))
+
+    def _set_blocks(self) -> None:
+        """Set the blocks, positive demands and capacities with the accumulated edits"""
+        self._blocks, self._demand, self._capacity = self.lp_provision.get_blocks(
+            self.service_type_name, self._updated_blocks
+        )
+
+    def _set_provision(self, supplied: pd.Series) -> None:
+        """Set the provision of the blocks with demand in the `get_provision()` format"""
+        blocks = self._blocks.loc[self._blocks.index.isin(self._demand.index)].copy()
+        blocks["demand"] = self._demand
+        blocks["supplied"] = supplied
+        blocks["provision"] = blocks["supplied"] / blocks["demand"]
+        self._provision = blocks
+
+    def _get_pairs(self, demand: pd.Series, capacity: pd.Series) -> pd.DataFrame:
+        """Get the accessible pairs of the demand and capacity blocks"""
+        return self.lp_provision.get_accessible_pairs(self.service_type_name, demand, capacity)
+
+    def _solve(self, demand: pd.Series, capacity: pd.Series) -> pd.Series:
+        """Solve the sparse transportation problem of the blocks and get supplied demand by blocks"""
+        return self.lp_provision.solve(self.service_type_name, demand, capacity)
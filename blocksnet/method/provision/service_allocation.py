@@ -0,0 +1,292 @@
+"""
+Greedy allocation of service capacities to living blocks on arrays, used by the provision model.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from ...models import ServicesGraph
+
+
+class ServiceAllocation:
+    """
+    Greedy allocation of a service type capacities to the demand of living blocks.
+
+    Living blocks take the demand unit by unit in rounds, in the order of the graph nodes: a service block takes
+    its own capacity, the other blocks take the capacity of the nearest service block which has it. Rounds in
+    which every block takes from the same service block as in the previous one are not simulated one by one,
+    the number of such rounds is found from the remaining demands and capacities and they are assigned at once.
+    Allocation state is kept between the runs, as the graph of the provision model keeps it.
+
+    Nearest-first allocation assigns the demand to the nearest service blocks of all the blocks first instead:
+    the pairs of blocks and services are taken from a heap in the order of travel times.
+    """
+
+    NONE = 0
+    """Block takes nothing in the round"""
+    PROVIDED = 1
+    """Block takes the capacity of an accessible service block"""
+    WEAKLY_PROVIDED = 2
+    """Block takes the capacity of a service block out of accessibility"""
+    BLOCKED = 3
+    """Service block which has its own capacity but is provided already"""
+
+    def __init__(self, graph: ServicesGraph, service_type: str):
+        attributes = graph.attributes
+        n_nodes = len(attributes)
+        self.nodes = graph.nodes
+        """Blocks ids in the nodes order"""
+        self.is_living = attributes["is_living"].to_numpy(dtype=bool)
+        """Living blocks in the nodes order"""
+        self.is_service = attributes[f"is_{service_type}_service"].to_numpy() >= 1
+        """Service blocks in the nodes order"""
+        self.population = attributes["population"].to_numpy(dtype=np.float64)
+        self.capacity = attributes[f"{service_type}_capacity"].to_numpy(dtype=np.float64, copy=True)
+        """Remaining capacities of the blocks"""
+        self.population_prov = attributes[f"population_prov_{service_type}"].to_numpy(dtype=np.float64, copy=True)
+        self.provision = attributes[f"provision_{service_type}"].to_numpy(dtype=np.float64, copy=True)
+        self.population_unprov = attributes[f"population_unprov_{service_type}"].to_numpy(dtype=np.float64, copy=True)
+        self.demand = np.zeros(n_nodes)
+        self.weakly_prov = np.zeros(n_nodes)
+        # service neighbours of living blocks are sorted by travel times, ties are kept in the nodes order
+        edges = graph.adjacency.tocoo()
+        is_neighbour = (edges.row != edges.col) & self.is_living[edges.row] & self.is_service[edges.col]
+        rows, columns = edges.row[is_neighbour], edges.col[is_neighbour]
+        weights = np.round(edges.data[is_neighbour].astype(np.float64), 1)
+        order = np.lexsort((columns, weights, rows))
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_nodes))])
+        """Offsets of the blocks sorted neighbours"""
+        # the sentinel is pointed to by the blocks which have no neighbours left
+        self.neighbours = np.append(columns[order], -1)
+        """Service neighbours of the blocks sorted by travel times"""
+        self.weights = np.append(weights[order], np.inf)
+        """Travel times to the sorted neighbours (in minutes)"""
+        self._candidates: dict[tuple, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def allocate(self, standard: float, accessibility: float, overflow: bool = False, scale: float = 1) -> None:
+        """
+        Allocate the remaining capacities to the demand of the living blocks population.
+
+        Attributes
+        ----------
+        standard: float
+            Demand per 1000 population
+        accessibility: float
+            Normative accessibility of the service type (in minutes)
+        overflow: bool
+            Whether the demand is weakly provided by the service blocks out of accessibility
+        scale: float
+            Divisor of the demands and capacities, so the unit of allocation is `scale` units of them
+        """
+        self._start(standard, accessibility, overflow, scale)
+        nodes = np.flatnonzero(self.is_living)
+        while self._units > 0:
+            units = self._units
+            if (self._unprov[nodes] > 0).all():
+                # no block leaves the round, so the same rounds are repeated until a demand or a capacity runs out
+                units_taken = self._take_rounds(nodes)
+            else:
+                units_taken = 0
+            if units_taken == 0:
+                nodes = self._take_round(nodes)
+            if self._units == units:
+                break
+
+        self._finish()
+
+    def allocate_nearest(self, standard: float, accessibility: float, overflow: bool = False, scale: float = 1) -> None:
+        """
+        Allocate the remaining capacities to the demand of the living blocks population, nearest pairs first.
+        Attributes are the same as of `allocate()`
+        """
+        self._start(standard, accessibility, overflow, scale)
+        indptr, candidates, weights = self._get_candidates(accessibility, overflow)
+        capacity, unprov = self._capacity, self._unprov
+        pointer = indptr[:-1].copy()
+        nodes = np.flatnonzero(self.is_living & (unprov > 0) & (pointer < indptr[1:]))
+        heap = list(zip(weights[pointer[nodes]].tolist(), nodes.tolist()))
+        heapq.heapify(heap)
+        while len(heap) > 0 and self._units > 0:
+            weight, node = heapq.heappop(heap)
+            service = candidates[pointer[node]]
+            if capacity[service] >= 1:
+                units = min(math.ceil(unprov[node]), math.floor(capacity[service]), self._units)
+                capacity[service] -= units
+                unprov[node] -= units
+                self._units -= units
+                if weight <= accessibility:
+                    self._population_prov[node] += units
+                    self._is_provided[node] = True
+                else:
+                    self._weakly_prov[node] += units
+                if unprov[node] <= 0:
+                    continue
+            # the service has run out, so the block waits for its next nearest service
+            pointer[node] += 1
+            if pointer[node] < indptr[node + 1]:
+                heapq.heappush(heap, (weights[pointer[node]], node))
+        self._finish()
+
+    def _get_candidates(self, accessibility: float, overflow: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get offsets, service blocks and travel times of the blocks candidates: a service block itself and its
+        service neighbours within accessibility, or all of them with overflow. Candidates are found once
+        """
+        key = (accessibility, overflow)
+        if key not in self._candidates:
+            n_nodes = len(self.is_living)
+            rows = np.repeat(np.arange(n_nodes), np.diff(self.indptr))
+            columns, weights = self.neighbours[:-1], self.weights[:-1]
+            if not overflow:
+                is_accessible = weights <= accessibility
+                rows, columns, weights = rows[is_accessible], columns[is_accessible], weights[is_accessible]
+            own = np.flatnonzero(self.is_living & self.is_service)
+            rows = np.concatenate([own, rows])
+            # neighbours are sorted already, the stable sort puts the blocks themselves first
+            order = np.argsort(rows, kind="stable")
+            self._candidates[key] = (
+                np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_nodes))]),
+                np.concatenate([own, columns])[order],
+                np.concatenate([np.zeros(len(own)), weights])[order],
+            )
+        return self._candidates[key]
+
+    def _start(self, standard: float, accessibility: float, overflow: bool, scale: float) -> None:
+        """Set the demands and capacities at the start of the allocation"""
+        self._capacity = self.capacity.copy()
+        self._capacity[self.is_service] /= scale
+        self._unprov = np.where(self.is_living, self.population / 1000 * standard, 0) / scale
+        self._demand = self._unprov.copy()
+        self._population_prov = self.population_prov.copy()
+        self._weakly_prov = np.zeros(len(self.is_living))
+        self._is_provided = np.zeros(len(self.is_living), dtype=bool)
+        self._pointer = self.indptr[:-1].copy()
+        self._accessibility, self._overflow = accessibility, overflow
+        total_load = np.trunc(self._unprov[self.is_living]).astype(np.int64).sum()
+        total_capacity = np.trunc(self._capacity[self.is_service]).astype(np.int64).sum()
+        # every unit decreases both the total load and the total capacity, so they limit the units together
+        self._units = max(min(total_load, total_capacity), 0)
+
+    def _finish(self) -> None:
+        """Keep the allocation state after the allocation"""
+        provided = self._is_provided
+        self.provision[provided] = self._population_prov[provided] * 100 / self._demand[provided]
+        self.capacity = self._capacity
+        self.population_prov = self._population_prov
+        self.population_unprov = self._unprov
+        self.demand = self._demand
+        self.weakly_prov = self._weakly_prov
+
+    def _advance(self, nodes: np.ndarray) -> None:
+        """Move the blocks pointers past the neighbours without capacity"""
+        while len(nodes) > 0:
+            nodes = nodes[self._pointer[nodes] < self.indptr[nodes + 1]]
+            nodes = nodes[self._capacity[self.neighbours[self._pointer[nodes]]] < 1]
+            self._pointer[nodes] += 1
+
+    def _get_decisions(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get what the blocks take in a round by the current capacities, the blocks the capacity is taken from
+        and the blocks which capacities the decisions depend on (-1 if they do not depend on any capacity)
+        """
+        own = self.is_service[nodes] & (self._capacity[nodes] >= 1)
+        self._advance(nodes[~own])
+        pointer = self._pointer[nodes]
+        has_neighbour = ~own & (pointer < self.indptr[nodes + 1])
+        is_accessible = self.weights[pointer] <= self._accessibility
+        decisions = np.full(len(nodes), self.NONE)
+        decisions[own] = np.where(self._get_provision(nodes[own]) < 100, self.PROVIDED, self.BLOCKED)
+        decisions[has_neighbour & is_accessible] = self.PROVIDED
+        if self._overflow:
+            decisions[has_neighbour & ~is_accessible] = self.WEAKLY_PROVIDED
+        sources = np.where(own, nodes, np.where(has_neighbour, self.neighbours[pointer], -1))
+        # blocks which take nothing from the neighbours out of accessibility do not depend on their capacities
+        keys = np.where(decisions == self.NONE, -1, sources)
+        return decisions, sources, keys
+
+    def _get_provision(self, nodes: np.ndarray) -> np.ndarray:
+        """Get the current provision of the blocks, which is updated with every provided unit"""
+        provision = self._population_prov[nodes] * 100 / np.where(self._is_provided[nodes], self._demand[nodes], 1)
+        return np.where(self._is_provided[nodes], provision, self.provision[nodes])
+
+    def _take(self, nodes: np.ndarray, decisions: np.ndarray, sources: np.ndarray, rounds: int = 1) -> None:
+        """Assign the units of the rounds to the taking blocks"""
+        is_taking = (decisions == self.PROVIDED) | (decisions == self.WEAKLY_PROVIDED)
+        np.subtract.at(self._capacity, sources[is_taking], rounds)
+        self._unprov[nodes[is_taking]] -= rounds
+        provided = nodes[decisions == self.PROVIDED]
+        self._population_prov[provided] += rounds
+        self._is_provided[provided] = True
+        self._weakly_prov[nodes[decisions == self.WEAKLY_PROVIDED]] += rounds
+        self._units -= rounds * is_taking.sum()
+
+    def _take_rounds(self, nodes: np.ndarray) -> int:
+        """Assign the units of the rounds repeating the current one at once and get the number of units"""
+        decisions, sources, keys = self._get_decisions(nodes)
+        is_taking = (decisions == self.PROVIDED) | (decisions == self.WEAKLY_PROVIDED)
+        n_taking = is_taking.sum()
+        if n_taking == 0:
+            return 0
+        rounds = self._units // n_taking
+        # capacities stay enough for the blocks taking them and for the provided service blocks relying on them
+        takes = np.bincount(sources[is_taking], minlength=len(self.is_living))
+        taken = np.flatnonzero(takes)
+        rounds = min(rounds, (np.floor(self._capacity[taken]) // takes[taken]).min())
+        blocked = keys[(decisions == self.BLOCKED) & (takes[np.maximum(keys, 0)] > 0)]
+        if len(blocked) > 0:
+            rounds = min(rounds, ((np.floor(self._capacity[blocked]) - 1) // takes[blocked]).min())
+        # demands stay positive before the last round
+        rounds = min(rounds, np.ceil(self._unprov[nodes[is_taking]]).min())
+        own = nodes[(decisions == self.PROVIDED) & (sources == nodes)]
+        if len(own) > 0:
+            rounds = min(rounds, self._get_provided_rounds(own, rounds))
+        rounds = int(rounds)
+        if rounds <= 0:
+            return 0
+        self._take(nodes, decisions, sources, rounds)
+        return rounds * n_taking
+
+    def _get_provided_rounds(self, nodes: np.ndarray, max_rounds: int) -> int:
+        """Get the number of rounds the service blocks stay not provided and take their own capacity"""
+        demand, population_prov = self._demand[nodes], self._population_prov[nodes]
+
+        def is_not_provided(rounds):
+            return (population_prov + rounds) * 100 / demand < 100
+
+        # provision is checked before every unit, so the rounds are counted after the first one
+        rounds = np.clip(np.ceil(demand - population_prov) - 1, 0, max_rounds)
+        while (grow := (rounds < max_rounds) & is_not_provided(rounds + 1)).any():
+            rounds[grow] += 1
+        while (shrink := (rounds > 0) & ~is_not_provided(rounds)).any():
+            rounds[shrink] -= 1
+        return int(rounds.min()) + 1
+
+    def _take_round(self, nodes: np.ndarray) -> np.ndarray:
+        """Assign the units of one round block by block and get the blocks left for the next round"""
+        # a block without demand leaves the round, and the next block is skipped in this round
+        removed, skipped = [], -1
+        for position in np.flatnonzero(self._unprov[nodes] <= 0):
+            if position != skipped:
+                removed.append(position)
+                skipped = position + 1
+        is_taking_round = np.ones(len(nodes), dtype=bool)
+        is_taking_round[removed] = False
+        is_taking_round[[position + 1 for position in removed if position + 1 < len(nodes)]] = False
+        queue = nodes[is_taking_round]
+        # decisions are made by the capacities at the round start until a capacity runs out before a block
+        while len(queue) > 0 and self._units > 0:
+            decisions, sources, keys = self._get_decisions(queue)
+            is_taking = (decisions == self.PROVIDED) | (decisions == self.WEAKLY_PROVIDED)
+            is_taking &= np.cumsum(is_taking) <= self._units
+            keyed = np.flatnonzero(keys >= 0)
+            keyed = keyed[np.argsort(keys[keyed], kind="stable")]
+            taken = np.cumsum(is_taking[keyed]) - is_taking[keyed]
+            starts = np.flatnonzero(np.diff(keys[keyed], prepend=-2))
+            taken -= np.repeat(taken[starts], np.diff(np.append(starts, len(keyed))))
+            invalid = keyed[taken >= np.floor(self._capacity[keys[keyed]])]
+            end = invalid.min() if len(invalid) > 0 else len(queue)
+            decisions = np.where(is_taking, decisions, self.NONE)
+            self._take(queue[:end], decisions[:end], sources[:end])
+            queue = queue[end:]
+        return np.delete(nodes, removed)
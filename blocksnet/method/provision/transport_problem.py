@@ -0,0 +1,200 @@
+"""
+Min-cost flow formulation of the sparse provision transportation problem, re-optimised from its previous solution.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import bellman_ford, dijkstra
+
+
+class TransportProblem:
+    """
+    Transportation problem between demand and capacity blocks solved as a min-cost flow with successive shortest
+    paths.
+
+    Capacity nodes send flow to the accessible demand nodes or to the unused node, the overflow node supplies
+    the demand which can not be supplied. The flow is kept together with nodes potentials proving its optimality,
+    so after demands or capacities change the problem is re-optimised from the previous flow: only the changed
+    amounts are routed along shortest paths instead of solving the whole problem from scratch.
+    """
+
+    OVERFLOW = 0
+    """Node supplying the demand which can not be supplied"""
+    UNUSED = 1
+    """Node consuming the capacity which is not used"""
+
+    def __init__(self, overflow_cost: int):
+        self.overflow_cost = overflow_cost
+        """Cost of the demand supplied by the overflow node"""
+        self.rows: dict = {}
+        """Nodes of the demand blocks by blocks ids"""
+        self.columns: dict = {}
+        """Nodes of the capacity blocks by blocks ids"""
+        self.tail = np.array([self.OVERFLOW], dtype=np.int64)
+        self.head = np.array([self.UNUSED], dtype=np.int64)
+        self.cost = np.array([0], dtype=np.int64)
+        self.flow = np.array([0], dtype=np.int64)
+        self.supply = np.zeros(2, dtype=np.int64)
+        self.potential = np.zeros(2, dtype=np.float64)
+
+    def copy(self) -> "TransportProblem":
+        """Get the copy of the problem which can be changed and re-optimised independently"""
+        return copy.deepcopy(self)
+
+    def _add_edges(self, tail: np.ndarray, head: np.ndarray, cost: np.ndarray) -> None:
+        self.tail = np.concatenate([self.tail, tail])
+        self.head = np.concatenate([self.head, head])
+        self.cost = np.concatenate([self.cost, cost])
+        self.flow = np.concatenate([self.flow, np.zeros(len(tail), dtype=np.int64)])
+
+    def add_blocks(self, rows: list, columns: list, pairs: pd.DataFrame) -> None:
+        """
+        Add demand and capacity blocks with zero demands and capacities.
+
+        Attributes
+        ----------
+        rows: list
+            Ids of the new demand blocks
+        columns: list
+            Ids of the new capacity blocks
+        pairs: pd.DataFrame
+            Accessible pairs with at least one new block: `row` and `column` blocks ids and integer `cost`
+        """
+        n_nodes = len(self.supply)
+        self.rows.update(zip(rows, range(n_nodes, n_nodes + len(rows))))
+        self.columns.update(zip(columns, range(n_nodes + len(rows), n_nodes + len(rows) + len(columns))))
+        row_nodes = np.arange(n_nodes, n_nodes + len(rows))
+        column_nodes = np.arange(len(columns)) + n_nodes + len(rows)
+        tail = pairs["column"].map(self.columns).to_numpy(dtype=np.int64)
+        head = pairs["row"].map(self.rows).to_numpy(dtype=np.int64)
+        cost = pairs["cost"].to_numpy(dtype=np.int64)
+        self.supply = np.concatenate([self.supply, np.zeros(len(rows) + len(columns), dtype=np.int64)])
+        # new nodes carry no flow, so their potentials are chosen to keep all the reduced costs nonnegative
+        potential = np.concatenate([self.potential, np.full(len(rows) + len(columns), np.nan)])
+        potential[row_nodes] = potential[self.OVERFLOW] + self.overflow_cost
+        from_old = tail < n_nodes
+        np.minimum.at(potential, head[from_old], potential[tail[from_old]] + cost[from_old])
+        potential[column_nodes] = potential[self.UNUSED]
+        np.maximum.at(potential, tail[~from_old], potential[head[~from_old]] - cost[~from_old])
+        self.potential = potential
+        self._add_edges(np.full(len(rows), self.OVERFLOW), row_nodes, np.full(len(rows), self.overflow_cost))
+        self._add_edges(column_nodes, np.full(len(columns), self.UNUSED), np.zeros(len(columns), dtype=np.int64))
+        self._add_edges(tail, head, cost)
+        # edges are kept sorted by their nodes to find them and to build the residual graph quickly
+        order = np.lexsort((self.head, self.tail))
+        self.tail, self.head = self.tail[order], self.head[order]
+        self.cost, self.flow = self.cost[order], self.flow[order]
+
+    def set_supplies(self, demand: pd.Series, capacity: pd.Series) -> None:
+        """Set integer demands and capacities of the blocks, missing blocks get zero"""
+        self.supply[:] = 0
+        self.supply[[self.rows[i] for i in demand.index]] = -demand.to_numpy(dtype=np.int64)
+        self.supply[[self.columns[i] for i in capacity.index]] = capacity.to_numpy(dtype=np.int64)
+        self.supply[self.OVERFLOW] = demand.sum()
+        self.supply[self.UNUSED] = -capacity.sum()
+
+    def _get_excess(self) -> np.ndarray:
+        """Get supplies of the nodes which are not routed by the flow yet"""
+        n_nodes = len(self.supply)
+        outflow = np.bincount(self.tail, self.flow, n_nodes).astype(np.int64)
+        return self.supply - outflow + np.bincount(self.head, self.flow, n_nodes).astype(np.int64)
+
+    def _get_residual(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get tails, heads and reduced costs of the residual graph edges, where the edges are uncapacitated
+        and the reversed edges are limited by their flows. Reversed edges ids are also returned
+        """
+        reverse = np.flatnonzero(self.flow > 0)
+        reverse = reverse[np.lexsort((self.tail[reverse], self.head[reverse]))]
+        tail = np.concatenate([self.tail, self.head[reverse]])
+        head = np.concatenate([self.head, self.tail[reverse]])
+        cost = np.concatenate([self.cost, -self.cost[reverse]]) + self.potential[tail] - self.potential[head]
+        return tail, head, cost, reverse
+
+    def set_flow(self, pairs: pd.DataFrame, potentials: tuple[np.ndarray, np.ndarray] | None = None) -> None:
+        """
+        Set the optimal flow of the current supplies solved by another engine along with the potentials proving
+        its optimality.
+
+        Attributes
+        ----------
+        pairs: pd.DataFrame
+            Integer `flow` of the accessible pairs between `row` and `column` blocks ids
+        potentials: tuple[np.ndarray, np.ndarray] | None
+            Integer potentials of the demand and capacity blocks in the order they were added, e.g. the dual values
+            of the supply constraints. If they do not prove the optimality, they are found with Bellman-Ford
+        """
+        n_nodes = len(self.supply)
+        keys = self.tail * n_nodes + self.head
+        pairs_keys = pairs["column"].map(self.columns).to_numpy(dtype=np.int64) * n_nodes
+        pairs_keys += pairs["row"].map(self.rows).to_numpy(dtype=np.int64)
+        self.flow[:] = 0
+        self.flow[np.searchsorted(keys, pairs_keys)] = np.rint(pairs["flow"]).astype(np.int64)
+        # the overflow supplies the rest of the demand and the rest of the capacity is unused
+        excess = self._get_excess()
+        is_overflow = (self.tail == self.OVERFLOW) & (self.head != self.UNUSED)
+        is_unused = (self.head == self.UNUSED) & (self.tail != self.OVERFLOW)
+        self.flow[is_overflow] = -excess[self.head[is_overflow]]
+        self.flow[is_unused] = excess[self.tail[is_unused]]
+        self.flow[(self.tail == self.OVERFLOW) & (self.head == self.UNUSED)] = self._get_excess()[self.OVERFLOW]
+        self.potential[:] = 0
+        if potentials is not None:
+            self.potential[list(self.rows.values())] = np.rint(potentials[0])
+            self.potential[list(self.columns.values())] = np.rint(potentials[1])
+            if (self._get_residual()[2] >= 0).all():
+                return
+            self.potential[:] = 0
+        # distances from a virtual root in the residual graph of the optimal flow, which has no negative cycles
+        tail, head, cost, _ = self._get_residual()
+        graph = sp.coo_matrix(
+            (
+                np.concatenate([cost, np.zeros(n_nodes)]),
+                (np.concatenate([tail, np.full(n_nodes, n_nodes)]), np.concatenate([head, np.arange(n_nodes)])),
+            ),
+            shape=(n_nodes + 1, n_nodes + 1),
+        ).tocsr()
+        self.potential = bellman_ford(graph, indices=n_nodes)[:n_nodes]
+
+    def solve(self) -> None:
+        """Re-optimise the flow for the current supplies with successive shortest paths"""
+        n_nodes = len(self.supply)
+        excess = self._get_excess()
+        while (excess > 0).any():
+            tail, head, cost, reverse = self._get_residual()
+            # residual edges are sorted by their nodes to find the paths edges, reversed edges get negative ids.
+            # Edges and reversed edges are sorted already, so the stable sort only merges them
+            keys = tail * n_nodes + head
+            order = np.argsort(keys, kind="stable")
+            keys, edges = keys[order], np.concatenate([np.arange(len(self.tail)), -1 - reverse])[order]
+            # explicit zeros of the csr matrix are the edges of zero reduced cost
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(tail, minlength=n_nodes))])
+            graph = sp.csr_matrix((cost[order], head[order], indptr), shape=(n_nodes, n_nodes))
+            distances, predecessors, sources = dijkstra(
+                graph, indices=np.flatnonzero(excess > 0), return_predecessors=True, min_only=True
+            )
+            targets = np.flatnonzero((excess < 0) & np.isfinite(distances))
+            assert len(targets) > 0, "Transportation problem is infeasible"
+            targets = targets[np.argsort(distances[targets], kind="stable")]
+            # shortest paths consist of the edges of zero reduced cost, so the flow along any of them stays optimal
+            self.potential += np.minimum(distances, distances[targets[-1]])
+            for target in targets:
+                path = [target]
+                while path[-1] != sources[target]:
+                    path.append(predecessors[path[-1]])
+                path = np.array(path[::-1])
+                path_edges = edges[np.searchsorted(keys, path[:-1] * n_nodes + path[1:])]
+                backward = -1 - path_edges[path_edges < 0]
+                amount = min(excess[path[0]], -excess[target], *self.flow[backward])
+                if amount <= 0:
+                    continue
+                self.flow[path_edges[path_edges >= 0]] += amount
+                self.flow[backward] -= amount
+                excess[path[0]] -= amount
+                excess[target] += amount
+
+    def get_supplied(self, rows: pd.Index) -> np.ndarray:
+        """Get demand of the blocks supplied by the capacity blocks"""
+        supplied = np.bincount(self.head, np.where(self.tail == self.OVERFLOW, 0, self.flow), len(self.supply))
+        return supplied[[self.rows[i] for i in rows]]
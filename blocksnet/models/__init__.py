@@ -1,5 +1,7 @@
 """
 Models classes are located here.
 """
+from .accessibility_matrix import AccessibilityMatrix
 from .city_model import CityModel
 from .geojson import GeoJSON, PointGeoJSON, PolygonGeoJSON
+from .services_graph import ServicesGraph
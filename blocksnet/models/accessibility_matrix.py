@@ -0,0 +1,178 @@
+"""
+Accessibility matrix model between city blocks is defined here.
+"""
+import os
+from typing import Any, ClassVar
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pydantic import BaseModel, Field, InstanceOf, PrivateAttr, field_validator, model_validator
+
+
+class AccessibilityMatrix(BaseModel):
+    """
+    Accessibility matrix between city blocks.
+
+    Travel times are stored as a dense NxN array along with the blocks ids, either as `float32` minutes
+    or as `uint16` deciminutes to halve the memory. The matrix can be saved to `.npy` files and loaded
+    back memory-mapped, so several processes share one on-disk matrix.
+
+    If `max_time` is set, the matrix is sparse: a CSR matrix only stores pairs reachable within `max_time`
+    minutes (zero times are stored explicitly), all the other pairs are considered unreachable.
+    """
+
+    DECIMINUTES: ClassVar[int] = 10
+    """Deciminutes in one minute, used by `uint16` matrices"""
+    UNREACHABLE: ClassVar[int] = np.iinfo(np.uint16).max
+    """`uint16` value of unreachable or too far pairs"""
+
+    index: InstanceOf[np.ndarray]
+    """Blocks ids of the matrix rows and columns"""
+    values: Any
+    """NxN travel times array or CSR matrix (`float32` minutes or `uint16` deciminutes)"""
+    max_time: float | None = Field(None, gt=0)
+    """Maximum travel time stored in a sparse matrix (in minutes), `None` for dense matrices"""
+    _df: pd.DataFrame | None = PrivateAttr(None)
+
+    @model_validator(mode="before")
+    @classmethod
+    def validate_df(cls, value):
+        """Allow the matrix to be constructed from an accessibility DataFrame"""
+        if isinstance(value, dict) and "df" in value:
+            value = value.copy()
+            df = value.pop("df")
+            assert len(df.columns) == len(df.index), "Size must be NxN"
+            assert all(df.columns.unique() == df.index.unique()), "Columns and rows are not equal"
+            value["index"] = df.index.to_numpy()
+            value["values"] = df.to_numpy(dtype=np.float32)
+        return value
+
+    @field_validator("values")
+    @classmethod
+    def validate_values_type(cls, value):
+        assert isinstance(value, (np.ndarray, sp.csr_matrix)), "Matrix must be a numpy array or a CSR matrix"
+        return value
+
+    @model_validator(mode="after")
+    def validate_values(self):
+        assert self.values.ndim == 2 and self.values.shape == (len(self.index),) * 2, "Size must be NxN"
+        assert self.values.dtype in (np.float32, np.uint16), "Matrix must be float32 or uint16"
+        assert self.is_sparse == (self.max_time is not None), "Sparse matrices must have max_time set"
+        assert len(np.unique(self.index)) == len(self.index), "Blocks ids must be unique"
+        return self
+
+    @property
+    def is_sparse(self) -> bool:
+        """Whether the matrix only stores pairs reachable within `max_time`"""
+        return sp.issparse(self.values)
+
+    @classmethod
+    def _encode(cls, minutes: np.ndarray, dtype: type) -> np.ndarray:
+        """Convert travel times in minutes to the storage dtype"""
+        if np.dtype(dtype) == np.uint16:
+            deciminutes = np.rint(np.asarray(minutes, dtype=np.float64) * cls.DECIMINUTES)
+            deciminutes[~(deciminutes < cls.UNREACHABLE)] = cls.UNREACHABLE
+            return deciminutes.astype(np.uint16)
+        return np.asarray(minutes, dtype=np.float32)
+
+    def _decode(self, values: np.ndarray) -> np.ndarray:
+        """Convert stored travel times to minutes. `float32` values are returned without copying"""
+        if values.dtype == np.uint16:
+            minutes = values.astype(np.float32) / self.DECIMINUTES
+            minutes[values == self.UNREACHABLE] = np.inf
+            return minutes
+        return values
+
+    @classmethod
+    def from_df(
+        cls, df: pd.DataFrame, dtype: type = np.float32, max_time: float | None = None
+    ) -> "AccessibilityMatrix":
+        """
+        Construct the matrix from an accessibility DataFrame, optionally storing it as uint16 deciminutes
+        or as a sparse matrix of pairs reachable within `max_time`
+        """
+        return cls.from_array(df.index.to_numpy(), df.to_numpy(), dtype, max_time)
+
+    @classmethod
+    def from_array(
+        cls, index: np.ndarray, minutes: np.ndarray, dtype: type = np.float32, max_time: float | None = None
+    ) -> "AccessibilityMatrix":
+        """Construct the matrix from blocks ids and a travel times array in minutes"""
+        if max_time is None:
+            return cls(index=np.asarray(index), values=cls._encode(minutes, dtype))
+        rows, cols = np.nonzero(np.asarray(minutes) <= max_time)
+        return cls.from_pairs(index, rows, cols, np.asarray(minutes)[rows, cols], max_time, dtype)
+
+    @classmethod
+    def from_pairs(  # pylint: disable=too-many-arguments
+        cls,
+        index: np.ndarray,
+        rows: np.ndarray,
+        cols: np.ndarray,
+        minutes: np.ndarray,
+        max_time: float,
+        dtype: type = np.float32,
+    ) -> "AccessibilityMatrix":
+        """Construct a sparse matrix from reachable pairs positions and their travel times in minutes"""
+        shape = (len(index),) * 2
+        # coo to csr conversion keeps explicit zeros, which are the travel times inside the same block
+        values = sp.coo_matrix((cls._encode(minutes, dtype), (rows, cols)), shape=shape).tocsr()
+        return cls(index=np.asarray(index), values=values, max_time=max_time)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """
+        Accessibility matrix DataFrame (in minutes), lazily created view over the dense array.
+        Sparse matrices are densified with unreachable pairs set to `np.inf`
+        """
+        if self._df is None:
+            index = pd.Index(self.index)
+            self._df = pd.DataFrame(self.to_minutes(), index=index, columns=index, copy=False)
+        return self._df
+
+    def to_minutes(self) -> np.ndarray:
+        """Dense travel times array in minutes. Dense `float32` matrices are returned without copying"""
+        if self.is_sparse:
+            return self.get_submatrix(self.index, self.index)
+        return self._decode(self.values)
+
+    def get_submatrix(self, rows: np.ndarray, columns: np.ndarray, fill_value: float = np.inf) -> np.ndarray:
+        """
+        Get dense travel times (in minutes) between the given blocks ids.
+        Pairs which are not stored in a sparse matrix are set to `fill_value`
+        """
+        positions = pd.Index(self.index)
+        rows, columns = positions.get_indexer(rows), positions.get_indexer(columns)
+        assert (rows >= 0).all() and (columns >= 0).all(), "Blocks ids are not in the matrix"
+        if not self.is_sparse:
+            return self._decode(self.values[np.ix_(rows, columns)])
+        submatrix = self.values[rows][:, columns].tocoo()
+        result = np.full(submatrix.shape, fill_value, dtype=np.float32)
+        result[submatrix.row, submatrix.col] = self._decode(submatrix.data)
+        return result
+
+    def save(self, path: str) -> None:
+        """Save the matrix to the directory as `.npy` files"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "index.npy"), self.index)
+        if self.is_sparse:
+            np.save(os.path.join(path, "data.npy"), self.values.data)
+            np.save(os.path.join(path, "indices.npy"), self.values.indices)
+            np.save(os.path.join(path, "indptr.npy"), self.values.indptr)
+            np.save(os.path.join(path, "max_time.npy"), self.max_time)
+        else:
+            np.save(os.path.join(path, "values.npy"), self.values)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "AccessibilityMatrix":
+        """Load the matrix from the directory. With `mmap` the values are memory-mapped read-only"""
+        mmap_mode = "r" if mmap else None
+        index = np.load(os.path.join(path, "index.npy"))
+        if not os.path.exists(os.path.join(path, "max_time.npy")):
+            return cls(index=index, values=np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode))
+        arrays = [
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ("data", "indices", "indptr")
+        ]
+        values = sp.csr_matrix(tuple(arrays), shape=(len(index),) * 2, copy=False)
+        return cls(index=index, values=values, max_time=float(np.load(os.path.join(path, "max_time.npy"))))
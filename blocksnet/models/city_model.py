@@ -3,35 +3,27 @@ The aim of this module is to create one window to get any required data for othe
 All data is gathered once and then reused during calculations.
 """
 
+import json
+import os
+
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from typing import Literal, Optional
-from pydantic import BaseModel, Field, InstanceOf, field_validator
-from shapely import LineString
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
+import shapely
 import matplotlib.pyplot as plt
 
+from .accessibility_matrix import AccessibilityMatrix
 from .geojson import PolygonGeoJSON, PointGeoJSON
+from .services_graph import ServicesGraph
+from ..utils.blocks_index import BlocksIndex
 
 # from blocksnet.preprocessing.utils import Utils
 
 # from blocksnet.method.blocks.blocks_cutter import BlocksCutter
-class AccessibilityMatrix(BaseModel):
-    """
-    Accessibility matrix between city blocks
-    """
-
-    df: InstanceOf[pd.DataFrame]
-    """
-    Accessibility matrix DataFrame
-    """
-
-    @field_validator("df", mode="before")
-    def validate_df(value):
-        assert len(value.columns) == len(value.index), "Size must be NxN"
-        assert all(value.columns.unique() == value.index.unique()), "Columns and rows are not equal"
-        return value.copy()
 
 
 class CityBlockFeature(BaseModel):
@@ -87,8 +79,101 @@ class CityModel(BaseModel):  # pylint: disable=too-many-instance-attributes,too-
     """Accessibility matrix between city blocks"""
     services: dict[str, PointGeoJSON[ServicesFeature]]
     """Services geometries of the city"""
-    services_graph: InstanceOf[nx.Graph] = Field(exclude=True, default=None)
-    """nx.Graph of the city, containing provision assessment capacities"""
+    _graphs: dict[str, ServicesGraph] = PrivateAttr(default_factory=dict)
+
+    _blocks_index: BlocksIndex | None = PrivateAttr(None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # services graphs depend on all the fields, so they are rebuilt on the next request
+        if name in self.model_fields:
+            self._graphs = {}
+            self._blocks_index = None
+
+    def _get_blocks_ids(self, service_types: list[str]) -> dict[str, pd.Series]:
+        """Blocks ids of the services of the service types, found with the blocks index built once"""
+        if self._blocks_index is None:
+            self._blocks_index = BlocksIndex(self.blocks.to_gdf(), id_column="block_id")
+        layers = {service_type: self.services[service_type].geometry for service_type in service_types}
+        return self._blocks_index.get_blocks_ids(layers)
+
+    def get_service_graph(self, service_type: str) -> ServicesGraph:
+        """
+        Get the array-backed graph of the city blocks containing provision assessment capacities of the service
+        type. The graph is built the first time the service type is requested and reused afterwards
+        """
+        if service_type not in self._graphs:
+            self._graphs[service_type] = self._prepare_graph([service_type])
+        return self._graphs[service_type]
+
+    def warm(self, service_types: list[str] | None = None) -> None:
+        """Build the graphs of the service types (all the city service types by default) in advance"""
+        service_types = self.get_service_types() if service_types is None else service_types
+        # services of all the types are assigned to blocks at once
+        self._get_blocks_ids(service_types)
+        for service_type in service_types:
+            self.get_service_graph(service_type)
+
+    @property
+    def graph(self) -> ServicesGraph:
+        """Array-backed graph of the city blocks, containing provision assessment capacities of all service types"""
+        return ServicesGraph.merge([self.get_service_graph(service_type) for service_type in self.get_service_types()])
+
+    @graph.setter
+    def graph(self, value: ServicesGraph) -> None:
+        self._graphs = {service_type: value.get_service_graph(service_type) for service_type in value.service_types}
+
+    @property
+    def services_graph(self) -> nx.Graph:
+        """
+        nx.Graph view of the city graph, created node by node on every access, so it is only meant for the callers
+        working with networkx. Assign a changed graph to update the city
+        """
+        return self.graph.to_networkx()
+
+    @services_graph.setter
+    def services_graph(self, value: nx.Graph) -> None:
+        self.graph = ServicesGraph.from_networkx(value)
+
+    def save(self, path: str) -> None:
+        """
+        Save the city model to the directory: blocks and services as Parquet, accessibility matrix as `.npy` files
+        and services graphs as CSR arrays. Services graphs of all the service types are built before saving
+        """
+        self.warm()
+        os.makedirs(os.path.join(path, "services"), exist_ok=True)
+        self.blocks.to_parquet(os.path.join(path, "blocks.parquet"))
+        for service_type, service in self.services.items():
+            service.to_parquet(os.path.join(path, "services", f"{service_type}.parquet"))
+        self.accessibility_matrix.save(os.path.join(path, "accessibility_matrix"))
+        for service_type, graph in self._graphs.items():
+            graph.save(os.path.join(path, "graphs", service_type))
+        with open(os.path.join(path, "city_model.json"), "w", encoding="utf-8") as file:
+            json.dump({"services": self.get_service_types(), "graphs": list(self._graphs)}, file)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CityModel":
+        """
+        Load the city model saved with `save()` without validation and graphs building.
+        With `mmap` the accessibility matrix and services graphs adjacency are memory-mapped
+        """
+        with open(os.path.join(path, "city_model.json"), encoding="utf-8") as file:
+            contents = json.load(file)
+        city_model = cls.model_construct(
+            blocks=PolygonGeoJSON[CityBlockFeature].read_parquet(os.path.join(path, "blocks.parquet")),
+            accessibility_matrix=AccessibilityMatrix.load(os.path.join(path, "accessibility_matrix"), mmap),
+            services={
+                service_type: PointGeoJSON[ServicesFeature].read_parquet(
+                    os.path.join(path, "services", f"{service_type}.parquet")
+                )
+                for service_type in contents["services"]
+            },
+        )
+        city_model._graphs = {
+            service_type: ServicesGraph.load(os.path.join(path, "graphs", service_type), mmap)
+            for service_type in contents["graphs"]
+        }
+        return city_model
 
     def get_service_types(self) -> list[str]:
         return list(self.services.keys())
@@ -102,7 +187,7 @@ class CityModel(BaseModel):  # pylint: disable=too-many-instance-attributes,too-
     @field_validator("accessibility_matrix", mode="before")
     def validate_matrix(value):
         if isinstance(value, pd.DataFrame):
-            return AccessibilityMatrix(df=value)
+            return AccessibilityMatrix.from_df(value)
         return value
 
     @field_validator("services", mode="before")
@@ -116,24 +201,97 @@ class CityModel(BaseModel):  # pylint: disable=too-many-instance-attributes,too-
     def visualize(self, max_distance=7) -> None:
         """Method for city model visualization"""
         blocks = self.blocks.to_gdf()
-        centroids = blocks.copy()
-        centroids["geometry"] = centroids["geometry"].centroid
-        edges = []
-        for u, v, a in self.services_graph.edges(data=True):
-            if a["weight"] < max_distance and a["weight"] > 0:
-                edges.append(
-                    {
-                        "distance": a["weight"],
-                        "geometry": LineString([centroids.loc[u, "geometry"], centroids.loc[v, "geometry"]]),
-                    }
-                )
-        edges = gpd.GeoDataFrame(edges).sort_values(ascending=False, by="distance")
+        centroids = blocks["geometry"].centroid
+        edges = self.graph.get_edges()
+        edges = edges[(edges["weight"] < max_distance) & (edges["weight"] > 0)]
+        # edges are taken from the array-backed graph, so no networkx view is created
+        coordinates = np.stack(
+            [shapely.get_coordinates(centroids.loc[edges[node]].to_numpy()) for node in ("u", "v")], axis=1
+        )
+        edges = gpd.GeoDataFrame(
+            {"distance": edges["weight"].to_numpy()}, geometry=shapely.linestrings(coordinates)
+        ).sort_values(ascending=False, by="distance")
         fig, ax = plt.subplots(figsize=(15, 15))
         blocks.plot(ax=ax, alpha=0.5, color="#ddd")
         edges.plot(ax=ax, alpha=0.1, column="distance", cmap="summer")
         plt.show()
 
-    def prepare_graph(  # pylint: disable=too-many-arguments,too-many-locals
+    def _get_service_capacities(self, service_type: str, updated_block_info: dict | None = None) -> pd.Series:
+        """Total capacity of the service type by blocks ids, only blocks with services are included"""
+        service = self.services[service_type].to_gdf()
+        blocks_ids = self._get_blocks_ids([service_type])[service_type]
+        capacities = service["capacity"].iloc[blocks_ids.index].groupby(blocks_ids.to_numpy()).sum().rename_axis("id")
+        for updated_block in (updated_block_info or {}).values():
+            if updated_block["block_id"] not in capacities.index:
+                capacities.loc[updated_block["block_id"]] = 0
+            if service_type == "recreational_areas":
+                capacities.loc[updated_block["block_id"]] += updated_block.get("G_max_capacity", 0)
+            else:
+                capacities.loc[updated_block["block_id"]] += updated_block.get(f"{service_type}_capacity", 0)
+        return capacities
+
+    def _prepare_graph(  # pylint: disable=too-many-locals
+        self, service_types: list[str], updated_block_info: dict | None = None
+    ) -> ServicesGraph:
+        """
+        Build the graph with edges from the service blocks to all the blocks and the service types attributes of
+        the blocks. Nodes are ordered as the blocks are met when iterating service blocks rows one by one.
+        """
+
+        blocks = self.blocks.to_gdf()
+        blocks.rename(columns={"current_population": "population_balanced", "block_id": "id"}, inplace=True)
+        blocks["is_living"] = blocks["population_balanced"] > 0
+        for updated_block in (updated_block_info or {}).values():
+            blocks.loc[updated_block["block_id"], "population_balanced"] = updated_block["population"]
+        blocks_attributes = blocks.set_index("id")
+
+        matrix = self.accessibility_matrix
+        living_ids = matrix.index[np.isin(matrix.index, blocks["id"])]
+        attributes = pd.DataFrame(
+            {
+                "population": blocks_attributes.loc[living_ids, "population_balanced"].to_numpy(),
+                "is_living": blocks_attributes.loc[living_ids, "is_living"].to_numpy(),
+                "id": living_ids,
+            },
+            index=living_ids,
+        )
+        nodes, edges = None, []
+
+        for service_type in service_types:
+            capacities = self._get_service_capacities(service_type, updated_block_info)
+            service_ids = matrix.index[np.isin(matrix.index, capacities.index)]
+            if len(service_ids) == 0:
+                continue
+            submatrix = matrix.get_submatrix(service_ids, living_ids)
+            # pairs which are out of the sparse matrix max_time are not connected
+            connected = np.isfinite(submatrix) & (service_ids[:, None] != living_ids[None, :])
+            rows, columns = np.nonzero(connected)
+            weights = np.round(submatrix[rows, columns].astype(np.float64), 1)
+            edges.append((service_ids[rows], living_ids[columns], weights))
+
+            if nodes is None:
+                # the first service block is added with its first edge, the rest of blocks are added in order
+                nodes = living_ids.tolist()
+                first_edge = np.flatnonzero(connected[0])
+                first_service = nodes.index(service_ids[0])
+                if len(first_edge) > 0 and first_edge[0] < first_service:
+                    nodes.insert(first_edge[0], nodes.pop(first_service))
+
+            is_service = np.isin(living_ids, service_ids)
+            attributes[f"is_{service_type}_service"] = is_service.astype(int)
+            attributes[f"provision_{service_type}"] = 0
+            attributes[f"id_{service_type}"] = 0
+            attributes[f"{service_type}_capacity"] = capacities.reindex(living_ids, fill_value=0).to_numpy()
+            # only living blocks have population attributes in the networkx view
+            attributes[f"population_prov_{service_type}"] = 0
+            attributes[f"population_unprov_{service_type}"] = attributes["population"].where(attributes["is_living"], 0)
+
+        if nodes is None:
+            return ServicesGraph.merge([])
+        sources, targets, weights = (np.concatenate(arrays) for arrays in zip(*edges))
+        return ServicesGraph.from_edges(attributes.loc[nodes], sources, targets, weights)
+
+    def prepare_graph(
         self,
         service_type: str,
         services_graph: nx.Graph,
@@ -143,115 +301,14 @@ class CityModel(BaseModel):  # pylint: disable=too-many-instance-attributes,too-
         This function prepares a graph for calculating the provision of a specified service in a city.
 
         Args:
-            blocks (gpd.GeoDataFrame): A GeoDataFrame containing information about the blocks in the city.
-            service_type (str, optional): The type of service to calculate the provision for. Defaults to None.
-            service_gdf (gpd.GeoDataFrame, optional): A GeoDataFrame containing information about blocks with the
-            specified service in the city. Defaults to None.
-            accessibility_matrix (np.ndarray, optional): An accessibility matrix for the city. Defaults to None.
-            buildings (gpd.GeoDataFrame, optional): A GeoDataFrame containing information about buildings in the city.
+            service_type (str): The type of service to calculate the provision for.
+            services_graph (nx.Graph): A graph to add the service blocks edges and attributes to.
+            updated_block_info (dict, optional): A dict containing updated information about blocks in the city.
             Defaults to None.
-            updated_block_info (gpd.GeoDataFrame, optional): A GeoDataFrame containing updated information
-            about blocks in the city. Defaults to None.
 
         Returns:
             nx.Graph: A networkx graph representing the city's road network with additional data for calculating
             the provision of the specified service.
         """
 
-        blocks = self.blocks.to_gdf()
-        service = self.services[service_type].to_gdf()
-        accessibility_matrix = self.accessibility_matrix.df.copy()
-
-        blocks.rename(columns={"current_population": "population_balanced", "block_id": "id"}, inplace=True)
-        blocks["is_living"] = blocks["population_balanced"].apply(lambda x: x > 0)
-
-        living_blocks = blocks.loc[:, ["id", "geometry"]].sort_values(by="id").reset_index(drop=True)
-
-        service_gdf = (
-            gpd.sjoin(blocks, service, predicate="intersects")
-            .groupby("id")
-            .agg(
-                {
-                    "capacity": "sum",
-                }
-            )
-        )
-
-        if updated_block_info:
-            for updated_block in updated_block_info.values():
-                if updated_block["block_id"] not in service_gdf.index:
-                    service_gdf.loc[updated_block["block_id"]] = 0
-                if service_type == "recreational_areas":
-                    service_gdf.loc[updated_block["block_id"], "capacity"] += updated_block.get("G_max_capacity", 0)
-                else:
-                    service_gdf.loc[updated_block["block_id"], "capacity"] += updated_block.get(
-                        f"{service_type}_capacity", 0
-                    )
-
-            blocks.loc[updated_block["block_id"], "population_balanced"] = updated_block["population"]
-
-        blocks_geom_dict = blocks[["id", "population_balanced", "is_living"]].set_index("id").to_dict()
-        service_blocks_dict = service_gdf.to_dict()["capacity"]
-
-        blocks_list = accessibility_matrix.loc[
-            accessibility_matrix.index.isin(service_gdf.index.astype("Int64")),
-            accessibility_matrix.columns.isin(living_blocks["id"]),
-        ]
-
-        # TODO: is tqdm really necessary?
-        for idx in list(blocks_list.index):
-            blocks_list_tmp = blocks_list[blocks_list.index == idx]
-            blocks_list.columns = blocks_list.columns.astype(int)
-            blocks_list_tmp_dict = blocks_list_tmp.transpose().to_dict()[idx]
-
-            for key in blocks_list_tmp_dict.keys():
-                if key != idx:
-                    services_graph.add_edge(idx, key, weight=round(blocks_list_tmp_dict[key], 1))
-
-                else:
-                    services_graph.add_node(idx)
-
-                services_graph.nodes[key]["population"] = blocks_geom_dict["population_balanced"][int(key)]
-                services_graph.nodes[key]["is_living"] = blocks_geom_dict["is_living"][int(key)]
-
-                if key != idx:
-                    try:
-                        if services_graph.nodes[key][f"is_{service_type}_service"] != 1:
-                            services_graph.nodes[key]["id"] = key
-                            services_graph.nodes[key][f"is_{service_type}_service"] = 0
-                            services_graph.nodes[key][f"provision_{service_type}"] = 0
-                            services_graph.nodes[key][f"id_{service_type}"] = 0
-                            services_graph.nodes[key][f"{service_type}_capacity"] = 0
-
-                    except KeyError:
-                        services_graph.nodes[key]["id"] = key
-                        services_graph.nodes[key][f"is_{service_type}_service"] = 0
-                        services_graph.nodes[key][f"provision_{service_type}"] = 0
-                        services_graph.nodes[key][f"id_{service_type}"] = 0
-                        services_graph.nodes[key][f"{service_type}_capacity"] = 0
-
-                else:
-                    services_graph.nodes[key]["id"] = key
-                    services_graph.nodes[key][f"is_{service_type}_service"] = 1
-                    services_graph.nodes[key][f"{service_type}_capacity"] = service_blocks_dict[key]
-                    services_graph.nodes[key][f"provision_{service_type}"] = 0
-                    services_graph.nodes[key][f"id_{service_type}"] = 0
-
-                if services_graph.nodes[key]["is_living"]:
-                    services_graph.nodes[key][f"population_prov_{service_type}"] = 0
-                    services_graph.nodes[key][f"population_unprov_{service_type}"] = blocks_geom_dict[
-                        "population_balanced"
-                    ][int(key)]
-
-        return services_graph
-
-    def model_post_init(self, __context) -> None:
-        values = self.dict()
-        services = values["services"]
-        services_graph = nx.Graph()
-        for service_type in services.keys():
-            services_graph = self.prepare_graph(
-                service_type=service_type,
-                services_graph=services_graph,
-            )
-        self.services_graph = services_graph
+        return self._prepare_graph([service_type], updated_block_info).to_networkx(services_graph)
@@ -1,13 +1,23 @@
 """
 Geojson response model and its inner parts are defined here.
 """
-from typing import Any, Generic, Literal, TypeVar
+from types import UnionType
+from typing import Annotated, Any, ClassVar, Generic, Literal, TypeVar, Union, get_args, get_origin
 
 import geopandas as gpd
-from pydantic import BaseModel
-from shapely.geometry import mapping
+import numpy as np
+import pandas as pd
+import shapely
+from pydantic import BaseModel, InstanceOf, PrivateAttr, TypeAdapter, field_validator, model_serializer, model_validator
+from pydantic.fields import FieldInfo
+from shapely.geometry import mapping, shape
 from shapely.geometry.base import BaseGeometry
 
+from ..utils.cache_info import CacheInfo
+
+
+_GEOMETRY_TYPE_IDS = {"Point": 0, "Polygon": 3, "MultiPolygon": 6}
+
 
 class Geometry(BaseModel):
     """Geometry representation for GeoJSON model"""
@@ -103,53 +113,216 @@ class PolygonFeature(Feature, Generic[_FeaturePropertiesType]):
         return PolygonGeometry.from_shapely_geometry(geoseries.geometry)
 
 
+_CONSTRAINTS = {
+    "ge": lambda values, bound: values < bound,
+    "gt": lambda values, bound: values <= bound,
+    "le": lambda values, bound: values > bound,
+    "lt": lambda values, bound: values >= bound,
+}
+"""Constraints violation checks for the properties columns"""
+
+
+def _validate_column(name: str, column: pd.Series, field: FieldInfo) -> pd.Series:
+    """Validate and cast a whole properties column against the feature schema field"""
+    annotation = field.annotation
+    args = [arg for arg in get_args(annotation) if arg is not type(None)]
+    nullable = get_origin(annotation) in (Union, UnionType) and len(args) < len(get_args(annotation))
+    if nullable and len(args) == 1:
+        annotation = args[0]
+    # NaN is a valid float value as it is for pydantic, so only other types are checked for missing values
+    missing = column.isna() if annotation is not float else pd.Series(False, index=column.index)
+    if missing.any() and not nullable:
+        raise ValueError(f"Property '{name}' contains missing values")
+    values = column[~missing]
+    if get_origin(annotation) is Literal:
+        if not values.isin(get_args(annotation)).all():
+            raise ValueError(f"Property '{name}' must be one of {get_args(annotation)}")
+    elif annotation is bool:
+        if not pd.api.types.is_bool_dtype(values):
+            if not values.isin([0, 1]).all():
+                raise ValueError(f"Property '{name}' must contain boolean values")
+            values = values.astype(bool)
+    elif annotation in (int, float):
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values)
+        if annotation is int:
+            if pd.api.types.is_float_dtype(values) and not (values % 1 == 0).all():
+                raise ValueError(f"Property '{name}' must contain integer values")
+            values = values.astype("int64")
+        else:
+            values = values.astype("float64")
+    elif annotation is str:
+        if not values.map(lambda value: isinstance(value, str)).all():
+            raise ValueError(f"Property '{name}' must contain string values")
+    else:
+        # rare field types are validated value by value with pydantic itself
+        adapter = TypeAdapter(Annotated[(field.annotation, *field.metadata)])
+        return column.map(adapter.validate_python)
+    for constraint in field.metadata:
+        for attr, check in _CONSTRAINTS.items():
+            bound = getattr(constraint, attr, None)
+            if bound is not None and check(values, bound).any():
+                raise ValueError(f"Property '{name}' must satisfy {attr}={bound}")
+    if missing.any():
+        return values.reindex(column.index)
+    return values
+
+
 _GeoJSONFeatureType = TypeVar("_GeoJSONFeatureType")  # pylint: disable=invalid-name
 
 
 class GeoJSON(BaseModel, Generic[_GeoJSONFeatureType]):
-    """GeoJSON model representation."""
+    """
+    GeoJSON model representation.
+
+    Features are stored in a columnar way: geometries as a shapely geometry array and properties as
+    typed columns validated against the feature properties schema. Serialized shape is still
+    `{"epsg": ..., "features": [{"geometry": ..., "properties": ...}, ...]}`.
+
+    The GeoDataFrame generated by `to_gdf()` and the `features` list are cached and dropped as soon as any
+    of the model fields is reassigned, so features should be changed by assignment rather than in place.
+    """
+
+    geometry_model: ClassVar[type[Geometry]] = Geometry
+    """Geometry model which defines allowed geometry types"""
 
     epsg: int
     """EPSG value"""
-    features: list[Feature[_GeoJSONFeatureType]]
-    """GeoJSON features list"""
+    geometry: InstanceOf[np.ndarray]
+    """Features geometries as a shapely geometry array"""
+    properties: InstanceOf[pd.DataFrame]
+    """Features properties as typed columns"""
+    _gdf: gpd.GeoDataFrame | None = PrivateAttr(None)
+    _features: list[Feature] | None = PrivateAttr(None)
+    _cache_info: CacheInfo = PrivateAttr(default_factory=CacheInfo)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self.model_fields:
+            self._gdf = None
+            self._features = None
 
-    @staticmethod
-    def _gdf_to_features(gdf, runtime_feature_type):
-        """Generate Features from GeoDataFrame"""
-        return gdf.apply(Feature[runtime_feature_type].from_geoseries, axis=1).to_list()
+    @classmethod
+    def _feature_type(cls) -> type[BaseModel] | None:
+        """Runtime features properties schema, if the model is parametrized"""
+        args = cls.__pydantic_generic_metadata__["args"]
+        return args[0] if args else None
+
+    @model_validator(mode="before")
+    @classmethod
+    def validate_features(cls, value):
+        """Split GeoJSON features list into geometry array and properties columns"""
+        if isinstance(value, dict) and "features" in value:
+            value = value.copy()
+            features = value.pop("features")
+            value["geometry"] = np.array([shape(feature["geometry"]) for feature in features], dtype=object)
+            feature_type = cls._feature_type()
+            # an empty features list still has the schema columns, so it is validated as an empty table
+            columns = list(feature_type.model_fields) if feature_type is not None and not features else None
+            value["properties"] = pd.DataFrame([dict(feature["properties"]) for feature in features], columns=columns)
+        return value
+
+    @field_validator("geometry", mode="plain")
+    @classmethod
+    def validate_geometry(cls, value):
+        geometry_types = get_args(cls.geometry_model.model_fields["type"].annotation)
+        value = np.asarray(value, dtype=object)
+        assert shapely.is_geometry(value).all(), "Features geometries must be shapely geometries"
+        assert np.isin(
+            shapely.get_type_id(value), [_GEOMETRY_TYPE_IDS[t] for t in geometry_types]
+        ).all(), f"Features geometries must be one of {geometry_types}"
+        return value
+
+    @field_validator("properties", mode="plain")
+    @classmethod
+    def validate_properties(cls, value):
+        assert isinstance(value, pd.DataFrame), "Features properties must be a DataFrame"
+        value = value.reset_index(drop=True)
+        feature_type = cls._feature_type()
+        if feature_type is None:
+            return value
+        columns = {}
+        for name, field in feature_type.model_fields.items():
+            if name in value.columns:
+                columns[name] = _validate_column(name, value[name], field)
+            elif field.is_required():
+                raise ValueError(f"Missing required property '{name}'")
+            else:
+                columns[name] = pd.Series([field.get_default()] * len(value), index=value.index, dtype=object)
+        return pd.DataFrame(columns, index=value.index)
+
+    @model_validator(mode="after")
+    def validate_length(self):
+        assert len(self.geometry) == len(self.properties), "Geometries and properties must have the same length"
+        return self
+
+    @model_serializer
+    def serialize(self) -> dict[str, Any]:
+        """Serialize the model in GeoJSON-like shape"""
+        features = []
+        for geom, properties in zip(self.geometry, self.properties.to_dict("records")):
+            geometry = mapping(geom)
+            features.append(
+                {
+                    "geometry": {"type": geometry["type"], "coordinates": list(geometry["coordinates"])},
+                    "properties": properties,
+                }
+            )
+        return {"epsg": self.epsg, "features": features}
+
+    @property
+    def features(self) -> list[Feature[_GeoJSONFeatureType]]:
+        """GeoJSON features list, constructed on the first access and cached"""
+        if self._features is None:
+            feature_type = self._feature_type() or dict
+            self._features = [Feature[feature_type].model_validate(feature) for feature in self.serialize()["features"]]
+        return list(self._features)
 
     @classmethod
     def from_gdf(cls, gdf: gpd.GeoDataFrame) -> "GeoJSON[_GeoJSONFeatureType]":
         """Construct GeoJSON model from geopandas GeoDataFrame."""
-        runtime_feature_type = cls.__pydantic_generic_metadata__["args"][0]
-        features = cls._gdf_to_features(gdf, runtime_feature_type)
-        return cls(features=features, epsg=gdf.crs.to_epsg())
+        properties = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        return cls(epsg=gdf.crs.to_epsg(), geometry=np.asarray(gdf.geometry.array), properties=properties)
+
+    def to_parquet(self, path: str) -> None:
+        """Save the features to the Parquet file"""
+        self.to_gdf().to_parquet(path)
+
+    @classmethod
+    def read_parquet(cls, path: str) -> "GeoJSON[_GeoJSONFeatureType]":
+        """Read the features saved with `to_parquet()`. They were validated before saving, so validation is skipped"""
+        gdf = gpd.read_parquet(path)
+        properties = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        return cls.model_construct(
+            epsg=gdf.crs.to_epsg(), geometry=np.asarray(gdf.geometry.array), properties=properties
+        )
+
+    def cache_info(self) -> CacheInfo:
+        """Get `to_gdf()` cache usage statistics"""
+        return self._cache_info.model_copy()
 
     def to_gdf(self) -> gpd.GeoDataFrame:
-        """Generate GeoDataFrame for the object"""
-        gdf = gpd.GeoDataFrame.from_features(map(lambda feature: feature.to_dict(), self.features))
-        gdf.set_crs(epsg=self.epsg, inplace=True)
-        return gdf
+        """
+        Generate GeoDataFrame for the object. The GeoDataFrame is built once and cached, each call returns
+        its copy: only property buffers are copied, geometries are shared, so the copy can be modified freely.
+        """
+        if self._gdf is None:
+            self._cache_info.misses += 1
+            gdf = gpd.GeoDataFrame(self.properties.copy())
+            gdf.insert(0, "geometry", gpd.GeoSeries(self.geometry, index=gdf.index, crs=self.epsg))
+            self._gdf = gdf.set_geometry("geometry")
+        else:
+            self._cache_info.hits += 1
+        return self._gdf.copy()
 
 
 class PointGeoJSON(GeoJSON, Generic[_GeoJSONFeatureType]):
     """Class for representing GeoJSON, containing point features"""
 
-    features: list[PointFeature[_GeoJSONFeatureType]]
-
-    @staticmethod
-    def _gdf_to_features(gdf, runtime_feature_type):
-        """Generate Features from GeoDataFrame"""
-        return gdf.apply(PointFeature[runtime_feature_type].from_geoseries, axis=1).to_list()
+    geometry_model: ClassVar[type[Geometry]] = PointGeometry
 
 
 class PolygonGeoJSON(GeoJSON, Generic[_GeoJSONFeatureType]):
     """Class for representing GeoJSON, containing polygon and multipolygon features"""
 
-    features: list[PolygonFeature[_GeoJSONFeatureType]]
-
-    @staticmethod
-    def _gdf_to_features(gdf, runtime_feature_type):
-        """Generate Features from GeoDataFrame"""
-        return gdf.apply(PolygonFeature[runtime_feature_type].from_geoseries, axis=1).to_list()
+    geometry_model: ClassVar[type[Geometry]] = PolygonGeometry
@@ -0,0 +1,167 @@
+"""
+Array-backed graph of city blocks used for provision assessment is defined here.
+"""
+import os
+import re
+from typing import ClassVar
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pydantic import BaseModel, InstanceOf, field_validator, model_validator
+
+
+class ServicesGraph(BaseModel):
+    """
+    Graph of city blocks containing provision assessment capacities.
+
+    Edges between service blocks and the other blocks are stored as a symmetric CSR adjacency matrix of
+    `float32` travel times. Blocks attributes (`population`, `is_{service}_service`, `{service}_capacity` etc.)
+    are stored as a table with one column per attribute. A `networkx` view of the graph is created on demand.
+    """
+
+    LIVING_ATTRIBUTES: ClassVar[tuple[str, ...]] = ("population_prov_", "population_unprov_")
+    """Prefixes of the attributes only living blocks have"""
+    SERVICE_ATTRIBUTES: ClassVar[tuple[str, ...]] = (
+        "is_{}_service",
+        "provision_{}",
+        "id_{}",
+        "{}_capacity",
+        "population_prov_{}",
+        "population_unprov_{}",
+    )
+    """Attributes of every service type, the rest of attributes are common for all service types"""
+
+    attributes: InstanceOf[pd.DataFrame]
+    """Blocks attributes indexed by blocks ids in the nodes order"""
+    adjacency: InstanceOf[sp.csr_matrix]
+    """Symmetric NxN travel times (in minutes) between the blocks in the nodes order"""
+
+    @field_validator("adjacency")
+    @classmethod
+    def validate_adjacency(cls, value):
+        assert value.dtype == np.float32, "Adjacency must be float32"
+        return value
+
+    @model_validator(mode="after")
+    def validate_shape(self):
+        assert self.adjacency.shape == (len(self.attributes),) * 2, "Adjacency size must be NxN"
+        assert self.attributes.index.is_unique, "Blocks ids must be unique"
+        return self
+
+    @property
+    def nodes(self) -> pd.Index:
+        """Blocks ids in the nodes order"""
+        return self.attributes.index
+
+    @property
+    def service_types(self) -> list[str]:
+        """Service types which attributes the graph contains"""
+        return [column[3:-8] for column in self.attributes.columns if re.fullmatch("is_.+_service", column)]
+
+    def get_service_graph(self, service_type: str) -> "ServicesGraph":
+        """Get the graph with only the service type attributes and the edges of its service blocks"""
+        service_columns = {
+            attribute.format(other_type) for other_type in self.service_types for attribute in self.SERVICE_ATTRIBUTES
+        }
+        own_columns = {attribute.format(service_type) for attribute in self.SERVICE_ATTRIBUTES}
+        columns = [column for column in self.attributes.columns if column not in service_columns - own_columns]
+        is_service = self.attributes[f"is_{service_type}_service"].to_numpy() >= 1
+        edges = self.adjacency.tocoo()
+        edges_mask = is_service[edges.row] | is_service[edges.col]
+        adjacency = sp.coo_matrix(
+            (edges.data[edges_mask], (edges.row[edges_mask], edges.col[edges_mask])), shape=self.adjacency.shape
+        ).tocsr()
+        return ServicesGraph(attributes=self.attributes[columns].copy(), adjacency=adjacency)
+
+    @classmethod
+    def merge(cls, graphs: list["ServicesGraph"]) -> "ServicesGraph":
+        """
+        Merge graphs of the same blocks into one in the nodes order of the first graph.
+        Attributes and edges of the latter graphs replace the former ones
+        """
+        graphs = [graph for graph in graphs if len(graph.nodes) > 0]
+        if len(graphs) == 0:
+            return cls(attributes=pd.DataFrame(), adjacency=sp.csr_matrix((0, 0), dtype=np.float32))
+        attributes = graphs[0].attributes.copy()
+        sources, targets, weights = [], [], []
+        for graph in graphs:
+            attributes[graph.attributes.columns] = graph.attributes.loc[attributes.index]
+            edges = sp.triu(graph.adjacency, k=1).tocoo()
+            sources.append(graph.nodes[edges.row])
+            targets.append(graph.nodes[edges.col])
+            weights.append(edges.data)
+        return cls.from_edges(attributes, *(np.concatenate(arrays) for arrays in (sources, targets, weights)))
+
+    @classmethod
+    def from_edges(
+        cls, attributes: pd.DataFrame, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray
+    ) -> "ServicesGraph":
+        """
+        Construct the graph from blocks attributes and undirected edges between blocks ids.
+        Parallel edges are replaced by the last one, as `networkx` does
+        """
+        positions = attributes.index.get_indexer
+        sources, targets = positions(np.asarray(sources)), positions(np.asarray(targets))
+        edges = pd.DataFrame(
+            {"u": np.minimum(sources, targets), "v": np.maximum(sources, targets), "w": np.asarray(weights)}
+        ).drop_duplicates(["u", "v"], keep="last")
+        rows = np.concatenate([edges["u"], edges["v"]])
+        columns = np.concatenate([edges["v"], edges["u"]])
+        data = np.concatenate([edges["w"], edges["w"]]).astype(np.float32)
+        # coo to csr conversion keeps explicit zeros, which are the travel times between adjacent blocks
+        adjacency = sp.coo_matrix((data, (rows, columns)), shape=(len(attributes),) * 2).tocsr()
+        return cls(attributes=attributes, adjacency=adjacency)
+
+    @classmethod
+    def from_networkx(cls, graph: nx.Graph) -> "ServicesGraph":
+        """Construct the graph from the `networkx` graph with `weight` edges attribute"""
+        attributes = pd.DataFrame.from_dict(dict(graph.nodes(data=True)), orient="index").fillna(0)
+        edges = list(graph.edges(data="weight"))
+        sources, targets, weights = (np.array(values) for values in zip(*edges)) if edges else ([], [], [])
+        return cls.from_edges(attributes, sources, targets, weights)
+
+    def to_networkx(self, graph: nx.Graph | None = None) -> nx.Graph:
+        """
+        Create the `networkx` view of the graph, or add the nodes and edges to the given graph.
+        Changes of the view are not reflected in the graph
+        """
+        graph = nx.Graph() if graph is None else graph
+        living_columns = [column for column in self.attributes.columns if column.startswith(self.LIVING_ATTRIBUTES)]
+        nodes = self.attributes.to_dict("index")
+        for data in nodes.values():
+            if not data["is_living"]:
+                for column in living_columns:
+                    del data[column]
+        graph.add_nodes_from(nodes.items())
+
+        edges = self.get_edges()
+        graph.add_weighted_edges_from(zip(edges["u"].tolist(), edges["v"].tolist(), edges["weight"].tolist()))
+        return graph
+
+    def get_edges(self) -> pd.DataFrame:
+        """Get the edges between `u` and `v` blocks ids with `weight` travel times (in minutes), each edge once"""
+        edges = sp.triu(self.adjacency, k=1, format="csr").tocoo()
+        # weights are rounded to 0.1 minute, so float32 values are converted back exactly
+        weights = np.round(edges.data.astype(np.float64), 1)
+        return pd.DataFrame({"u": self.nodes[edges.row], "v": self.nodes[edges.col], "weight": weights})
+
+    def save(self, path: str) -> None:
+        """Save the graph to the directory: attributes as Parquet and adjacency as CSR `.npy` arrays"""
+        os.makedirs(path, exist_ok=True)
+        self.attributes.to_parquet(os.path.join(path, "attributes.parquet"))
+        np.save(os.path.join(path, "data.npy"), self.adjacency.data)
+        np.save(os.path.join(path, "indices.npy"), self.adjacency.indices)
+        np.save(os.path.join(path, "indptr.npy"), self.adjacency.indptr)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "ServicesGraph":
+        """Load the graph from the directory without validation. With `mmap` the adjacency is memory-mapped"""
+        mmap_mode = "r" if mmap else None
+        attributes = pd.read_parquet(os.path.join(path, "attributes.parquet"))
+        arrays = [
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ("data", "indices", "indptr")
+        ]
+        adjacency = sp.csr_matrix(tuple(arrays), shape=(len(attributes),) * 2, copy=False)
+        return cls.model_construct(attributes=attributes, adjacency=adjacency)
@@ -4,3 +4,4 @@ Data getter utilities are located here.
 from .accs_matrix_calculator import Accessibility
 from .data_getter import DataGetter
 from .aggregate_parameters import AggregateParameters
+from .matrix_cache import MatrixCache
@@ -2,12 +2,21 @@
 This module provides all necessary tools to get accesibility matrix from transport graph
 """
 
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import geopandas as gpd
 import networkit as nk
 import networkx as nx
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse import csgraph
 from tqdm import tqdm
 
+from ..models import AccessibilityMatrix
+
 tqdm.pandas()
 
 
@@ -21,11 +30,13 @@ class Accessibility:  # pylint: disable=too-few-public-methods
     get_matrix
     """
 
-    def __init__(self, blocks, graph: nx.Graph = None):
+    def __init__(self, blocks, graph: nx.Graph = None, graph_cache: str | None = None):
         self.blocks = blocks
         """a dataframe with city blocks"""
         self.G = graph  # pylint: disable=invalid-name
         """transport graph (in networkx format). Walk, drive, bike or transport graph"""
+        self.graph_cache = graph_cache
+        """directory to cache the converted `networkit` graph and its nodes ids in"""
 
     def _get_nx2nk_idmap(self, graph: nx.Graph) -> dict:  # TODO: add typing for the dict
         """
@@ -64,11 +75,51 @@ class Accessibility:  # pylint: disable=too-few-public-methods
         )
         return attrs
 
-    def _convert_nx2nk(  # pylint: disable=too-many-locals,invalid-name
+    @staticmethod
+    def _get_edges(graph_nx: nx.Graph, idmap: dict, weight: str | None = "time_min") -> pd.DataFrame:
+        """
+        This method extracts graph edges to a DataFrame with `u`, `v` nodes ids from `idmap` and `w` weights
+        rounded the same way as in the converted graph. Parallel edges are collapsed to the one with the minimum
+        weight, endpoints of undirected edges are sorted.
+
+        Attributes
+        ----------
+        graph_nx: networkx graph
+        idmap: dict
+            map of ids in old nx and new nk graphs
+        weight: str, optional
+            value to be used as a edge's weight, edges are unweighted if not set
+
+        Returns
+        -------
+        edges: pd.DataFrame
+            unique edges of the graph
+        """
+
+        if weight:
+            edges = pd.DataFrame(graph_nx.edges(data=weight, default=1), columns=["u", "v", "w"])
+        else:
+            edges = pd.DataFrame(graph_nx.edges(), columns=["u", "v"])
+        edges["u"] = edges["u"].map(idmap)
+        edges["v"] = edges["v"].map(idmap)
+        if not graph_nx.is_directed():
+            edges[["u", "v"]] = np.sort(edges[["u", "v"]].to_numpy(), axis=1)
+        if weight:
+            return edges.groupby(["u", "v"], sort=False)["w"].min().round(1).reset_index()
+        return edges.drop_duplicates(["u", "v"])
+
+    @staticmethod
+    def _get_csr(edges: pd.DataFrame, n: int) -> sp.csr_matrix:
+        """This method builds the graph adjacency matrix from the edges, zero weights are kept as edges"""
+        return sp.coo_matrix((edges["w"], (edges["u"], edges["v"])), shape=(n, n)).tocsr()
+
+    def _convert_nx2nk(  # pylint: disable=invalid-name
         self, graph_nx: nx.Graph, idmap: dict | None = None, weight: str = "time_min"
     ) -> nk.Graph:
         """
         This method converts `networkx` graph to `networkit` graph to fasten calculations.
+        Edges endpoints and weights are extracted to arrays at once, parallel edges are collapsed to
+        the one with the minimum weight.
 
         Attributes
         ----------
@@ -88,97 +139,510 @@ class Accessibility:  # pylint: disable=too-few-public-methods
         if not idmap:
             idmap = self._get_nx2nk_idmap(graph_nx)
         n = max(idmap.values()) + 1
-        edges = list(graph_nx.edges())
+        edges = self._get_edges(graph_nx, idmap, weight)
 
         if weight:
             graph_nk = nk.Graph(n, directed=graph_nx.is_directed(), weighted=True)
-            for u_, v_ in edges:
-                u, v = idmap[u_], idmap[v_]
-                d = dict(graph_nx[u_][v_])
-                if len(d) > 1:
-                    for d_ in d.values():
-                        v__ = graph_nk.addNodes(2)
-                        u__ = v__ - 1
-                        w = round(d[weight], 1) if weight in d else 1
-                        graph_nk.addEdge(u, v, w)
-                        graph_nk.addEdge(u_, u__, 0)
-                        graph_nk.addEdge(v_, v__, 0)
-                else:
-                    d_ = list(d.values())[0]
-                    w = round(d_[weight], 1) if weight in d_ else 1
-                    graph_nk.addEdge(u, v, w)
+            for u, v, w in zip(edges["u"].tolist(), edges["v"].tolist(), edges["w"].tolist()):
+                graph_nk.addEdge(u, v, w)
         else:
             graph_nk = nk.Graph(n, directed=graph_nx.is_directed())
-            for u_, v_ in edges:
-                u, v = idmap[u_], idmap[v_]
+            for u, v in zip(edges["u"].tolist(), edges["v"].tolist()):
                 graph_nk.addEdge(u, v)
 
         return graph_nk
 
-    def _get_nk_distances(
-        self, nk_dists: nk.base.Algorithm, loc: pd.Series  # pylint: disable=c-extension-no-member
-    ) -> pd.Series:
+    def _get_nk_graph(self) -> nk.Graph:
+        """
+        This method converts the transport graph to `networkit` graph weighted with `time_min`. Nodes of the
+        converted graph are the positions of `self.G` nodes. If `graph_cache` is set, the converted graph is
+        saved there with a hash of its edges and weights and loaded back when the hash is the same.
+
+        Returns
+        -------
+        graph_nk: nk.Graph
+            Transport graph in `networkit` format
+        """
+
+        if self.graph_cache is None:
+            return self._convert_nx2nk(self.G, weight="time_min")
+        graph_path = os.path.join(self.graph_cache, "graph.nkbg")
+        key_path = os.path.join(self.graph_cache, "graph.sha256")
+        idmap = self._get_nx2nk_idmap(self.G)
+        edges = self._get_edges(self.G, idmap)
+        hash_ = hashlib.sha256(f"{self.G.is_directed()} {len(idmap)}".encode())
+        hash_.update(edges[["u", "v"]].to_numpy(dtype=np.int64).tobytes())
+        hash_.update(edges["w"].to_numpy(dtype=np.float64).tobytes())
+        key = hash_.hexdigest()
+        if os.path.exists(graph_path) and os.path.exists(key_path):
+            with open(key_path, encoding="utf-8") as file:
+                if file.read() == key:
+                    return nk.graphio.readGraph(graph_path, nk.Format.NetworkitBinary)
+        graph_nk = self._convert_nx2nk(self.G, idmap, weight="time_min")
+        os.makedirs(self.graph_cache, exist_ok=True)
+        nk.graphio.writeGraph(graph_nk, graph_path, nk.Format.NetworkitBinary)
+        with open(key_path, "w", encoding="utf-8") as file:
+            file.write(key)
+        return graph_nk
+
+    @staticmethod
+    def _get_nk_distances(graph_nk: nk.Graph, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
         """
-        This method calculates distances between blocks using nk SPSP algorithm.
-        The function is called inside apply function.
+        This method calculates distances from source nodes to target nodes at once using nk SPSP algorithm.
 
         Attributes
         ----------
-        nk_dists: nk.base.Algorithm
-            Compressed nk graph to compute distances between nodes using SPSP algorithm
-        loc: pd.Series
-            Row in the df
+        graph_nk: nk.Graph
+            Transport graph in `networkit` format
+        sources: np.ndarray
+            Source nodes
+        targets: np.ndarray
+            Target nodes
 
         Returns
         -------
-        pd.Series with computed distances
+        distances: np.ndarray
+            `float32` array of distances (sources x targets), unreachable targets are set to `np.inf`
         """
 
-        target_nodes = loc.index
-        source_node = loc.name
-        distances = [nk_dists.getDistance(source_node, node) for node in target_nodes]
-
-        return pd.Series(data=distances, index=target_nodes)
+        spsp = nk.distance.SPSP(graph_nk, sources, targets).run()  # pylint: disable=c-extension-no-member
+        distances = np.asarray(spsp.getDistances())
+        distances[distances > np.finfo(np.float32).max] = np.inf
+        return distances.astype(np.float32)
 
-    def get_matrix(self) -> pd.DataFrame:
+    def _get_blocks_nodes(self, graph_nx: nx.Graph | None = None) -> np.ndarray:
         """
-        This methods runs graph to matrix calculations
+        This method finds the closest graph node to every block representative point.
+
+        Attributes
+        ----------
+        graph_nx: networkx graph, optional
+            Graph to find the nodes in, defaults to the transport graph
 
         Returns
         -------
-        accs_matrix: pd.DataFrame
-            An accessibility matrix that contains time between all blocks in the city
+        nodes: np.ndarray
+            Position of the closest graph node of every block
         """
 
-        graph_nx = nx.convert_node_labels_to_integers(self.G)
-        graph_nk = self._convert_nx2nk(graph_nx, weight="time_min")
-
+        graph_nx = self.G if graph_nx is None else graph_nx
         graph_df = pd.DataFrame.from_dict(dict(graph_nx.nodes(data=True)), orient="index")
         graph_gdf = gpd.GeoDataFrame(
             graph_df, geometry=gpd.points_from_xy(graph_df["x"], graph_df["y"]), crs=self.blocks.crs.to_epsg()
         )
+        points = self.blocks["geometry"].representative_point()
+        from_blocks = graph_gdf["geometry"].sindex.nearest(points, return_distance=False, return_all=False)
+        return from_blocks[1]
+
+    @classmethod
+    def _get_chunk_rows(
+        cls, graph_nk: nk.Graph, unique_nodes: np.ndarray, inverse: np.ndarray, start: int, chunk_size: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        This method computes the matrix rows of the blocks closest to a chunk of unique source nodes.
+
+        Attributes
+        ----------
+        graph_nk: nk.Graph
+            Transport graph in `networkit` format
+        unique_nodes: np.ndarray
+            Unique closest graph nodes of the blocks
+        inverse: np.ndarray
+            Position of every block closest node in `unique_nodes`
+        start: int
+            Position of the chunk first source node in `unique_nodes`
+        chunk_size: int
+            Number of unique source nodes computed at once
+
+        Returns
+        -------
+        rows, distances: tuple[np.ndarray, np.ndarray]
+            Blocks positions and their `float32` distances to all the blocks
+        """
+
+        distances = cls._get_nk_distances(graph_nk, unique_nodes[start : start + chunk_size], unique_nodes)
+        (rows,) = np.nonzero((inverse >= start) & (inverse < start + chunk_size))
+        return rows, distances[inverse[rows] - start][:, inverse]
+
+    def _iter_rows(self, graph_nk: nk.Graph, nodes: np.ndarray, chunk_size: int):
+        """
+        This method computes the matrix rows by chunks of source nodes. Blocks sharing the closest node are
+        computed once.
+
+        Attributes
+        ----------
+        graph_nk: nk.Graph
+            Transport graph in `networkit` format
+        nodes: np.ndarray
+            Closest graph node of every block
+        chunk_size: int
+            Number of unique source nodes computed at once
+
+        Yields
+        ------
+        rows, distances: tuple[np.ndarray, np.ndarray]
+            Blocks positions and their `float32` distances to all the blocks
+        """
+
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        for start in tqdm(range(0, len(unique_nodes), chunk_size), desc="Accessibility matrix"):
+            yield self._get_chunk_rows(graph_nk, unique_nodes, inverse, start, chunk_size)
+
+    @staticmethod
+    def _fix_unconnected(values: np.ndarray, near_max: float, chunk_size: int) -> None:
+        """
+        This method replaces travel times of blocks, whose closest node is not connected to actual transport
+        infrastructure, with the maximum regular travel time chunk by chunk.
+        """
+
+        for start in range(0, len(values), chunk_size):
+            rows = values[start : start + chunk_size]
+            rows[rows > 500] = near_max
+
+    def get_matrix(self, max_time: float | None = None, chunk_size: int = 1000) -> pd.DataFrame | AccessibilityMatrix:
+        """
+        This methods runs graph to matrix calculations
+
+        Attributes
+        ----------
+        max_time: float, optional
+            If set, a sparse AccessibilityMatrix with only pairs reachable within `max_time` minutes is returned,
+            so memory scales with the number of reachable pairs rather than with the squared blocks count.
+            Unconnected blocks are fixed as in the dense matrix, it keeps exactly the dense pairs within `max_time`.
+        chunk_size: int
+            Number of unique source nodes whose distances are computed at once
+
+        Returns
+        -------
+        accs_matrix: pd.DataFrame | AccessibilityMatrix
+            An accessibility matrix that contains time between all blocks in the city
+        """
+
+        graph_nk = self._get_nk_graph()
+        nodes = self._get_blocks_nodes()
+        ids = self.blocks.index.to_numpy()
+
+        if max_time is not None:
+            pairs, unconnected = [], []
+            near_max = 0
+            for rows, distances in self._iter_rows(graph_nk, nodes, chunk_size):
+                near_max = max(near_max, distances[distances < 500].max(initial=0))
+                local_rows, columns = np.nonzero(distances <= min(max_time, 500))
+                pairs.append((rows[local_rows], columns, distances[local_rows, columns]))
+                # unconnected pairs get the maximum regular travel time as in the dense matrix, so they are
+                # within max_time only if all the regular travel times are
+                if near_max <= max_time:
+                    local_rows, columns = np.nonzero(distances > 500)
+                    unconnected.append((rows[local_rows], columns))
+            if near_max <= max_time:
+                pairs.extend((rows, columns, np.full(len(rows), near_max)) for rows, columns in unconnected)
+            rows, columns, times = (np.concatenate(arrays) for arrays in zip(*pairs))
+            return AccessibilityMatrix.from_pairs(ids, rows, columns, times, max_time)
+
+        accs_matrix = np.empty((len(nodes), len(nodes)), dtype=np.float32)
+        near_max = 0
+        for rows, distances in self._iter_rows(graph_nk, nodes, chunk_size):
+            accs_matrix[rows] = distances
+            near_max = max(near_max, distances[distances < 500].max(initial=0))
+
+        # bug fix in city block's closest node is no connecte to actual transport infrastructure
+        self._fix_unconnected(accs_matrix, near_max, chunk_size)
+
+        return pd.DataFrame(accs_matrix, index=pd.Index(ids, name="id"), columns=pd.Index(ids, name="id"))
+
+    @staticmethod
+    def _get_via_edges(  # pylint: disable=too-many-arguments
+        csr: sp.csr_matrix, directed: bool, edges: pd.DataFrame, sources: np.ndarray, targets: np.ndarray, limit: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        This method runs bounded Dijkstra searches from the edges endpoints.
+
+        Attributes
+        ----------
+        csr: sp.csr_matrix
+            Transport graph adjacency matrix weighted with `time_min`
+        directed: bool
+            Whether the graph is directed
+        edges: pd.DataFrame
+            Edges with `u`, `v` nodes positions
+        sources: np.ndarray
+            Nodes to get distances to the `u` nodes from
+        targets: np.ndarray
+            Nodes to get distances from the `v` nodes to
+        limit: float
+            Maximum distance to search within, farther nodes are set to `np.inf`
 
-        self.blocks = self.blocks[["geometry"]]
-        self.blocks.reset_index(inplace=True)
-        self.blocks.rename(columns={"index": "id"}, inplace=True)
-        self.blocks["centroids"] = self.blocks["geometry"].representative_point()
-        self.blocks.drop(columns=["geometry"], inplace=True)
-        self.blocks.rename(columns={"centroids": "geometry"}, inplace=True)
+        Returns
+        -------
+        to_u, from_v: tuple[np.ndarray, np.ndarray]
+            Distances from sources to `u` and from `v` to targets (edges x nodes)
+        """
+
+        reverse = csr.T.tocsr() if directed else csr
+        to_u = csgraph.dijkstra(reverse, directed=directed, indices=edges["u"].to_numpy(), limit=limit)[:, sources]
+        from_v = csgraph.dijkstra(csr, directed=directed, indices=edges["v"].to_numpy(), limit=limit)[:, targets]
+        return to_u, from_v
+
+    @staticmethod
+    def _is_recalculation_cheaper(to_u: np.ndarray, from_v: np.ndarray, n_nodes: int) -> bool:
+        """
+        This method estimates whether recalculating all the kept rows with Dijkstra searches over the graph nodes
+        is cheaper than checking the pairs of blocks reaching the changed edges.
+        """
+
+        pairs = (np.isfinite(to_u).sum(axis=1) * np.isfinite(from_v).sum(axis=1)).sum()
+        # a Dijkstra search takes about `n log n` steps for every row
+        return pairs > to_u.shape[1] * n_nodes * np.log2(max(n_nodes, 2))
+
+    @staticmethod
+    def _iter_via_edges(
+        to_u: np.ndarray, weights: pd.Series, from_v: np.ndarray, chunk_size: int, skipped: np.ndarray
+    ):  # pylint: disable=too-many-arguments
+        """
+        This method computes travel times between the blocks via the edges by chunks of rows. Only the blocks
+        reaching the edge `u` node and reachable from its `v` node are computed.
+
+        Attributes
+        ----------
+        to_u: np.ndarray
+            Distances from the blocks nodes to `u` nodes (edges x blocks)
+        weights: pd.Series
+            Edges weights
+        from_v: np.ndarray
+            Distances from `v` nodes to the blocks nodes (edges x blocks)
+        chunk_size: int
+            Number of rows computed at once
+        skipped: np.ndarray
+            Rows which are not computed, checked before every edge
+
+        Yields
+        ------
+        rows, columns, via_edge: tuple[np.ndarray, np.ndarray, np.ndarray]
+            Blocks positions and travel times between them via the edge (rows x columns)
+        """
+
+        for to_u_, w, from_v_ in zip(to_u, weights, from_v):
+            rows = np.flatnonzero(np.isfinite(to_u_) & ~skipped)
+            columns = np.flatnonzero(np.isfinite(from_v_))
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start : start + chunk_size]
+                yield chunk, columns, to_u_[chunk, None] + w + from_v_[None, columns]
+
+    def update_matrix(  # pylint: disable=too-many-locals
+        self,
+        matrix: pd.DataFrame,
+        old_graph: nx.Graph | None = None,
+        changed_blocks: list | None = None,
+        chunk_size: int = 1000,
+    ) -> pd.DataFrame:
+        """
+        This method updates the matrix calculated for the previous blocks and graph to the current ones, only
+        recalculating the affected rows and columns. The result matches `get_matrix()`.
 
-        from_blocks = graph_gdf["geometry"].sindex.nearest(
-            self.blocks["geometry"], return_distance=False, return_all=False
+        Blocks missing in the matrix are added and blocks missing in `blocks` are removed. Edges delta is found by
+        comparing `old_graph` with the transport graph. Bounded Dijkstra searches from the changed edges endpoints
+        find the rows whose shortest paths used lengthened or removed edges, they are recalculated, while the rest
+        of the rows are improved with shortened or added edges in place. Only the pairs of blocks reaching the
+        changed edges are checked, and all the rows are recalculated if checking them is more expensive.
+
+        Attributes
+        ----------
+        matrix: pd.DataFrame
+            Accessibility matrix calculated with `get_matrix()`
+        old_graph: networkx graph, optional
+            Transport graph the matrix was calculated on, defaults to the current transport graph
+        changed_blocks: list, optional
+            Ids of the blocks which geometry has changed
+        chunk_size: int
+            Number of unique source nodes whose distances are computed at once
+
+        Returns
+        -------
+        accs_matrix: pd.DataFrame
+            An accessibility matrix that contains time between all blocks in the city
+        """
+
+        old_graph = self.G if old_graph is None else old_graph
+        new_ids, old_ids = list(self.G.nodes()), list(old_graph.nodes())
+        new_idmap = dict(zip(new_ids, range(len(new_ids))))
+        old_idmap = dict(zip(old_ids, range(len(old_ids))))
+        nodes, old_nodes = self._get_blocks_nodes(), self._get_blocks_nodes(old_graph)
+
+        # blocks keep their rows and columns if they are not changed and are attached to the same graph node
+        ids = self.blocks.index
+        same_nodes = [new_ids[node] == old_ids[old_node] for node, old_node in zip(nodes, old_nodes)]
+        kept = ids.isin(matrix.index) & ~ids.isin(changed_blocks or []) & np.array(same_nodes, dtype=bool)
+        kept_positions = np.flatnonzero(kept)
+        values = np.empty((len(ids), len(ids)), dtype=np.float32)
+        kept_values = matrix.loc[ids[kept], ids[kept]].to_numpy(dtype=np.float32)
+        near_max = kept_values.max(initial=0)
+        # rows with the maximum time may contain unconnected blocks, which actual time is unknown
+        recalculated = (kept_values == near_max).any(axis=1)
+
+        new_edges = self._get_edges(self.G, new_idmap)
+        old_edges = self._get_edges(old_graph, old_idmap)
+        old_edges["u_id"] = [old_ids[u] for u in old_edges["u"]]
+        old_edges["v_id"] = [old_ids[v] for v in old_edges["v"]]
+        new_edges["u_id"] = [new_ids[u] for u in new_edges["u"]]
+        new_edges["v_id"] = [new_ids[v] for v in new_edges["v"]]
+        delta = old_edges.merge(new_edges, on=["u_id", "v_id"], how="outer", suffixes=("_old", "_new"))
+        directed = self.G.is_directed()
+
+        lengthened = delta[~(delta["w_new"] <= delta["w_old"]) & delta["w_old"].notna()]
+        lengthened = (
+            lengthened[["u_old", "v_old", "w_old"]].set_axis(["u", "v", "w"], axis=1).astype({"u": int, "v": int})
         )
+        if not directed:
+            lengthened = pd.concat([lengthened, lengthened.rename(columns={"u": "v", "v": "u"})])
+        if len(lengthened) > 0:
+            csr = self._get_csr(old_edges, len(old_ids))
+            kept_nodes = old_nodes[kept]
+            to_u, from_v = self._get_via_edges(csr, directed, lengthened, kept_nodes, kept_nodes, near_max)
+            if self._is_recalculation_cheaper(to_u, from_v, len(old_ids)):
+                recalculated[:] = True
+            for rows, columns, via_edge in self._iter_via_edges(
+                to_u, lengthened["w"], from_v, chunk_size, recalculated
+            ):
+                is_used = (np.abs(via_edge - kept_values[np.ix_(rows, columns)]) <= 1e-3).any(axis=1)
+                recalculated[rows[is_used]] = True
+
+        shortened = delta[~(delta["w_new"] >= delta["w_old"]) & delta["w_new"].notna()]
+        shortened = (
+            shortened[["u_new", "v_new", "w_new"]].set_axis(["u", "v", "w"], axis=1).astype({"u": int, "v": int})
+        )
+        if not directed:
+            shortened = pd.concat([shortened, shortened.rename(columns={"u": "v", "v": "u"})])
+        if len(shortened) > 0:
+            csr = self._get_csr(new_edges, len(new_ids))
+            kept_nodes = nodes[kept]
+            to_u, from_v = self._get_via_edges(csr, directed, shortened, kept_nodes, kept_nodes, near_max)
+            if self._is_recalculation_cheaper(to_u, from_v, len(new_ids)):
+                recalculated[:] = True
+            for rows, columns, via_edge in self._iter_via_edges(to_u, shortened["w"], from_v, chunk_size, recalculated):
+                block = np.ix_(rows, columns)
+                kept_values[block] = np.minimum(kept_values[block], via_edge)
+
+        values[np.ix_(kept_positions, kept_positions)] = kept_values
+        graph_nk = self._get_nk_graph()
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        rows = np.union1d(np.flatnonzero(~kept), kept_positions[recalculated])
+        for start in tqdm(range(0, len(rows), chunk_size), desc="Accessibility matrix rows"):
+            chunk = rows[start : start + chunk_size]
+            sources, sources_inverse = np.unique(nodes[chunk], return_inverse=True)
+            values[chunk] = self._get_nk_distances(graph_nk, sources, unique_nodes)[sources_inverse][:, inverse]
+
+        columns = np.flatnonzero(~kept)
+        transposed = nk.graphtools.transpose(graph_nk) if directed else graph_nk
+        for start in tqdm(range(0, len(columns), chunk_size), desc="Accessibility matrix columns"):
+            chunk = columns[start : start + chunk_size]
+            targets, targets_inverse = np.unique(nodes[chunk], return_inverse=True)
+            distances = self._get_nk_distances(transposed, targets, unique_nodes)
+            values[:, chunk] = distances[targets_inverse][:, inverse].T
+
+        # bug fix in city block's closest node is no connecte to actual transport infrastructure
+        self._fix_unconnected(values, values[values < 500].max(initial=0), chunk_size)
 
-        accs_matrix = pd.DataFrame(0, index=from_blocks[1], columns=from_blocks[1])
-        nk_dists = nk.distance.SPSP(  # pylint: disable=c-extension-no-member
-            graph_nk, sources=accs_matrix.index.values
-        ).run()
+        return pd.DataFrame(values, index=pd.Index(ids, name="id"), columns=pd.Index(ids, name="id"))
 
-        accs_matrix = accs_matrix.apply(lambda x: self._get_nk_distances(nk_dists, x), axis=1)
-        accs_matrix.index = self.blocks["id"]
-        accs_matrix.columns = self.blocks["id"]
+    @staticmethod
+    def _load_progress(path: str, nodes: np.ndarray, chunk_size: int) -> np.ndarray | None:
+        """
+        This method loads maximum regular travel times of the finished chunks (`np.nan` for the pending ones)
+        if the progress in `path` belongs to the same blocks and chunk size.
+        """
+
+        progress_path = os.path.join(path, "progress.npz")
+        if not os.path.exists(progress_path) or not os.path.exists(os.path.join(path, "values.npy")):
+            return None
+        progress = np.load(progress_path)
+        if progress["chunk_size"] != chunk_size or not np.array_equal(progress["nodes"], nodes):
+            return None
+        return progress["near_max"]
+
+    @staticmethod
+    def _save_progress(path: str, nodes: np.ndarray, chunk_size: int, near_max: np.ndarray) -> None:
+        """This method atomically saves the chunks progress to `path`"""
+
+        progress_path = os.path.join(path, "progress.npz")
+        with open(progress_path + ".tmp", "wb") as file:
+            np.savez(file, nodes=nodes, chunk_size=chunk_size, near_max=near_max)
+        os.replace(progress_path + ".tmp", progress_path)
+
+    def get_matrix_chunked(
+        self, path: str, processes: int | None = None, chunk_size: int = 1000
+    ) -> AccessibilityMatrix:
+        """
+        This method runs graph to matrix calculations by chunks of source nodes in a pool of processes.
+        Every finished chunk of rows is written to the memory-mapped `values.npy` in `path`, so peak RAM is bounded
+        by the chunk size rather than by the squared blocks count. Progress is saved after every chunk, and calling
+        the method again with the same `path` resumes an interrupted computation.
+
+        Attributes
+        ----------
+        path: str
+            Directory to write the matrix to, it can be loaded later with `AccessibilityMatrix.load(path)`
+        processes: int, optional
+            Number of worker processes, defaults to the number of CPUs
+        chunk_size: int
+            Number of unique source nodes computed at once by a worker
+
+        Returns
+        -------
+        accs_matrix: AccessibilityMatrix
+            Memory-mapped accessibility matrix
+        """
+
+        graph_nk = self._get_nk_graph()
+        nodes = self._get_blocks_nodes()
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        values_path = os.path.join(path, "values.npy")
+
+        near_max = self._load_progress(path, nodes, chunk_size)
+        if near_max is None:
+            os.makedirs(path, exist_ok=True)
+            np.save(os.path.join(path, "index.npy"), self.blocks.index.to_numpy())
+            np.lib.format.open_memmap(values_path, mode="w+", dtype=np.float32, shape=(len(nodes), len(nodes)))
+            near_max = np.full(len(range(0, len(unique_nodes), chunk_size)), np.nan)
+            self._save_progress(path, nodes, chunk_size, near_max)
+
+        pending = [chunk * chunk_size for chunk in np.flatnonzero(np.isnan(near_max))]
+        initargs = (graph_nk, unique_nodes, inverse, values_path, chunk_size)
+        with ProcessPoolExecutor(processes, initializer=_init_chunk_worker, initargs=initargs) as executor:
+            futures = [executor.submit(_write_chunk, start) for start in pending]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Accessibility matrix"):
+                start, chunk_near_max = future.result()
+                near_max[start // chunk_size] = chunk_near_max
+                self._save_progress(path, nodes, chunk_size, near_max)
 
         # bug fix in city block's closest node is no connecte to actual transport infrastructure
-        accs_matrix[accs_matrix > 500] = accs_matrix[accs_matrix < 500].max().max()
+        values = np.load(values_path, mmap_mode="r+")
+        self._fix_unconnected(values, near_max.max(), chunk_size)
+        values.flush()
+
+        return AccessibilityMatrix.load(path, mmap=True)
+
+
+_worker = {}
+"""State of a chunked matrix worker process, sent once per process instead of once per chunk"""
+
+
+def _init_chunk_worker(  # pylint: disable=too-many-arguments
+    graph_nk: nk.Graph, unique_nodes: np.ndarray, inverse: np.ndarray, values_path: str, chunk_size: int
+) -> None:
+    """Initialize a chunked matrix worker process"""
+    # parallelism comes from the processes, so every process computes distances in one thread
+    nk.setNumberOfThreads(1)
+    _worker.update(
+        graph_nk=graph_nk, unique_nodes=unique_nodes, inverse=inverse, values_path=values_path, chunk_size=chunk_size
+    )
+
 
-        return accs_matrix
+def _write_chunk(start: int) -> tuple[int, float]:
+    """Compute a chunk of the matrix rows and write them to the memory-mapped matrix"""
+    rows, distances = Accessibility._get_chunk_rows(  # pylint: disable=protected-access
+        _worker["graph_nk"], _worker["unique_nodes"], _worker["inverse"], start, _worker["chunk_size"]
+    )
+    values = np.load(_worker["values_path"], mmap_mode="r+")
+    values[rows] = distances
+    values.flush()
+    return start, float(distances[distances < 500].max(initial=0))
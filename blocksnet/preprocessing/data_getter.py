@@ -8,13 +8,15 @@ import networkx as nx
 import pandas as pd
 from tqdm.auto import tqdm
 from typing import Literal
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, PrivateAttr, field_validator
 
 from .aggregate_parameters import AggregateParameters
 from ..models.city_model import CityBlockFeature, AccessibilityMatrix
 from ..models import PolygonGeoJSON
 from ..method.blocks.blocks_cutter import BlocksCutterFeatureProperties
+from ..utils.blocks_index import BlocksIndex
 from .accs_matrix_calculator import Accessibility
+from .matrix_cache import MatrixCache
 
 tqdm.pandas()
 
@@ -25,6 +27,14 @@ class DataGetter(BaseModel):
     """
 
     blocks: PolygonGeoJSON[BlocksCutterFeatureProperties]
+    matrix_cache: MatrixCache | None = None
+    """Cache of the calculated accessibility matrices, matrices are recalculated every time if not set"""
+    _blocks_index: BlocksIndex | None = PrivateAttr(None)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "blocks":
+            self._blocks_index = None
 
     @field_validator("blocks", mode="before")
     def validate_blocks(value):
@@ -32,7 +42,9 @@ class DataGetter(BaseModel):
             return PolygonGeoJSON[BlocksCutterFeatureProperties].from_gdf(value)
         return value
 
-    def get_accessibility_matrix(self, graph: nx.Graph) -> AccessibilityMatrix:
+    def get_accessibility_matrix(
+        self, graph: nx.Graph, max_time: float | None = None, graph_key: str | None = None
+    ) -> AccessibilityMatrix:
         """
         This function returns an accessibility matrix for a city. The matrix is calculated using
         the `Accessibility` class.
@@ -41,13 +53,50 @@ class DataGetter(BaseModel):
             blocks (GeoDataFrame, optional): A GeoDataFrame containing information about the blocks in the city.
             Defaults to None.
             graph (Graph, optional): A networkx graph representing the city's road network. Defaults to None.
+            max_time (float, optional): If set, a sparse matrix only storing pairs reachable within `max_time`
+            minutes is returned. Defaults to None.
+            graph_key (str, optional): Key of the graph from `MatrixCache.get_graph_key()`. Calculate it once and pass
+            it to look the matrix up in `matrix_cache` without hashing the whole graph again. Defaults to None.
 
         Returns:
-            np.ndarray: An accessibility matrix for the city.
+            AccessibilityMatrix: An accessibility matrix for the city. It is taken from `matrix_cache` if the same
+            graph and blocks were already calculated.
         """
 
-        accessibility = Accessibility(self.blocks.to_gdf(), graph)
-        return AccessibilityMatrix(df=accessibility.get_matrix())
+        blocks = self.blocks.to_gdf()
+        if self.matrix_cache is not None:
+            key = self.matrix_cache.get_key(blocks, graph, max_time, graph_key)
+            matrix = self.matrix_cache.get(key)
+            if matrix is not None:
+                return matrix
+
+        accessibility = Accessibility(blocks, graph)
+        if max_time is not None:
+            matrix = accessibility.get_matrix(max_time=max_time)
+        else:
+            matrix = AccessibilityMatrix(df=accessibility.get_matrix())
+
+        if self.matrix_cache is not None:
+            self.matrix_cache.put(key, matrix)
+        return matrix
+
+    def _get_blocks_index(self) -> BlocksIndex:
+        """Spatial index of the blocks, built once and reused for all the aggregated layers"""
+        if self._blocks_index is None:
+            self._blocks_index = BlocksIndex(self.blocks.to_gdf(), id_column="id")
+        return self._blocks_index
+
+    @staticmethod
+    def _aggregate(layer: gpd.GeoDataFrame, blocks_ids: pd.Series, ids: pd.Series, agg: dict) -> pd.DataFrame:
+        """
+        Aggregate the layer features by blocks ids. Blocks without features get zero sums, as a left spatial join
+        followed by grouping does
+        """
+        features = layer.iloc[blocks_ids.index].set_axis(blocks_ids.to_numpy(), axis=0)
+        aggregated = features.groupby(level=0).agg(agg).reindex(ids.to_numpy())
+        sums = [column for column, function in agg.items() if function == "sum"]
+        aggregated[sums] = aggregated[sums].fillna(0)
+        return aggregated.rename_axis("id")
 
     @staticmethod
     def _get_living_area(row) -> float:
@@ -120,43 +169,47 @@ class DataGetter(BaseModel):
         buildings["living_area_pyatno"] = buildings.progress_apply(self._get_living_area_pyatno, axis=1)
         buildings["total_area"] = buildings["building_area"] * buildings["storeys_count"]
 
-        blocks_and_greens = (
-            gpd.sjoin(blocks, greenings, predicate="intersects", how="left")
-            .groupby("id")
-            .agg(
-                {
-                    "current_green_capacity": "sum",
-                    "current_green_area": "sum",
-                }
-            )
+        blocks_ids = self._get_blocks_index().get_blocks_ids(
+            {
+                "greenings": params.greenings.geometry,
+                "parkings": params.parkings.geometry,
+                "buildings": params.buildings.geometry,
+            }
+        )
+        ids = blocks["id"].drop_duplicates().sort_values()
+
+        blocks_and_greens = self._aggregate(
+            greenings,
+            blocks_ids["greenings"],
+            ids,
+            {
+                "current_green_capacity": "sum",
+                "current_green_area": "sum",
+            },
         )
         blocks_and_greens = (
             blocks_and_greens.reset_index(drop=True).reset_index(drop=False).rename(columns={"index": "block_id"})
         )
 
-        blocks_and_parkings = (
-            gpd.sjoin(blocks, parkings, predicate="intersects", how="left")
-            .groupby("id")
-            .agg({"current_parking_capacity": "sum"})
+        blocks_and_parkings = self._aggregate(
+            parkings, blocks_ids["parkings"], ids, {"current_parking_capacity": "sum"}
         )
         blocks_and_parkings = (
             blocks_and_parkings.reset_index(drop=True).reset_index(drop=False).rename(columns={"index": "block_id"})
         )
 
-        blocks_and_buildings = (
-            gpd.sjoin(blocks, buildings, predicate="intersects", how="left")
-            .drop(columns=["index_right"])
-            .groupby("id")
-            .agg(
-                {
-                    "population_balanced": "sum",
-                    "building_area": "sum",
-                    "storeys_count": "median",
-                    "total_area": "sum",
-                    "living_area": "sum",
-                    "living_area_pyatno": "sum",
-                }
-            )
+        blocks_and_buildings = self._aggregate(
+            buildings,
+            blocks_ids["buildings"],
+            ids,
+            {
+                "population_balanced": "sum",
+                "building_area": "sum",
+                "storeys_count": "median",
+                "total_area": "sum",
+                "living_area": "sum",
+                "living_area_pyatno": "sum",
+            },
         )
         blocks_and_buildings = (
             blocks_and_buildings.reset_index(drop=True).reset_index(drop=False).rename(columns={"index": "block_id"})
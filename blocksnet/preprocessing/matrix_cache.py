@@ -0,0 +1,132 @@
+"""
+On-disk cache of computed accessibility matrices is located here.
+"""
+import hashlib
+import os
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import shapely
+from pydantic import BaseModel, Field, PrivateAttr
+
+from ..models import AccessibilityMatrix
+from ..utils.cache_info import CacheInfo
+
+
+class MatrixCache(BaseModel):
+    """
+    Content-addressed cache of accessibility matrices.
+
+    Matrices are stored as compressed `.npz` files named by a hash of the transport graph edges and weights,
+    the graph nodes coordinates and the blocks representative points, so the same inputs give the same matrix
+    without recalculation. When the cache exceeds `max_size`, least recently used matrices are removed, except
+    for the matrix just saved.
+    """
+
+    path: str
+    """Directory to store the cached matrices in"""
+    max_size: int = Field(2 * 1024**3, gt=0)
+    """Maximum total size of the cached matrices in bytes"""
+    _cache_info: CacheInfo = PrivateAttr(default_factory=CacheInfo)
+
+    @staticmethod
+    def get_graph_key(graph: nx.Graph) -> str:
+        """
+        Get the hash of the graph nodes coordinates and its edges weighted with `time_min`. The graph is walked
+        in Python, so the key of a large graph is better calculated once and passed to `get_key()`
+        """
+        idmap = dict(zip(graph.nodes(), range(graph.number_of_nodes())))
+        coordinates = [(data["x"], data["y"]) for _, data in graph.nodes(data=True)]
+        edges = [(idmap[u], idmap[v], w) for u, v, w in graph.edges(data="time_min", default=1)]
+        hash_ = hashlib.sha256(str(graph.is_directed()).encode())
+        hash_.update(np.array(coordinates, dtype=np.float64).tobytes())
+        hash_.update(np.array(edges, dtype=np.float64).tobytes())
+        return hash_.hexdigest()
+
+    @staticmethod
+    def _update_blocks(hash_, blocks: gpd.GeoDataFrame) -> None:
+        """Update the hash with the blocks ids and representative points"""
+        points = blocks["geometry"].representative_point()
+        hash_.update(str(blocks.crs.to_epsg()).encode())
+        hash_.update(pd.util.hash_pandas_object(blocks.index, index=False).to_numpy().tobytes())
+        hash_.update(shapely.get_coordinates(points.to_numpy()).tobytes())
+
+    def get_key(
+        self,
+        blocks: gpd.GeoDataFrame,
+        graph: nx.Graph | None,
+        max_time: float | None = None,
+        graph_key: str | None = None,
+    ) -> str:
+        """
+        Get the cache key of the matrix calculated for the blocks on the graph. If `graph_key` calculated with
+        `get_graph_key()` is given, the graph is not hashed again and may be omitted
+        """
+        hash_ = hashlib.sha256((self.get_graph_key(graph) if graph_key is None else graph_key).encode())
+        self._update_blocks(hash_, blocks)
+        hash_.update(str(max_time).encode())
+        return hash_.hexdigest()
+
+    def _get_file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.npz")
+
+    def get(self, key: str) -> AccessibilityMatrix | None:
+        """Get the cached matrix by the key, `None` if it is not cached"""
+        file = self._get_file(key)
+        if not os.path.exists(file):
+            self._cache_info.misses += 1
+            return None
+        self._cache_info.hits += 1
+        # modification time marks the recent usage for the eviction
+        os.utime(file)
+        with np.load(file) as arrays:
+            if "max_time" not in arrays:
+                return AccessibilityMatrix(index=arrays["index"], values=arrays["values"])
+            shape = (len(arrays["index"]),) * 2
+            values = sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape)
+            return AccessibilityMatrix(index=arrays["index"], values=values, max_time=float(arrays["max_time"]))
+
+    def put(self, key: str, matrix: AccessibilityMatrix) -> None:
+        """Save the matrix by the key and evict least recently used matrices if the cache is too large"""
+        if matrix.is_sparse:
+            arrays = {
+                "data": matrix.values.data,
+                "indices": matrix.values.indices,
+                "indptr": matrix.values.indptr,
+                "max_time": matrix.max_time,
+            }
+        else:
+            arrays = {"values": matrix.values}
+        os.makedirs(self.path, exist_ok=True)
+        file = self._get_file(key)
+        with open(file + ".tmp", "wb") as tmp:
+            np.savez_compressed(tmp, index=matrix.index, **arrays)
+        os.replace(file + ".tmp", file)
+        self._evict(keep=file)
+
+    def _evict(self, keep: str) -> None:
+        """
+        Remove least recently used matrices until the cache fits `max_size`. The `keep` file just saved is never
+        removed, so a matrix larger than `max_size` is kept alone until the next one is saved
+        """
+        files = [entry for entry in os.scandir(self.path) if entry.name.endswith(".npz") and entry.path != keep]
+        size = os.path.getsize(keep)
+        files.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in files:
+            size += entry.stat().st_size
+            if size > self.max_size:
+                os.remove(entry.path)
+
+    def clear(self) -> None:
+        """Remove all the cached matrices"""
+        if os.path.exists(self.path):
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(".npz"):
+                    os.remove(entry.path)
+
+    def cache_info(self) -> CacheInfo:
+        """Get cache usage statistics"""
+        return self._cache_info.model_copy()
@@ -0,0 +1,72 @@
+"""
+Spatial index of city blocks reused for assigning geometries to blocks is located here.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from .cache_info import CacheInfo
+
+
+class BlocksIndex:
+    """
+    STRtree of city blocks, built once and reused to assign any number of geometries layers to blocks.
+
+    Layers are assigned with one vectorised tree query, the same way as `gpd.sjoin` with `intersects`
+    predicate does: a geometry on the border of several blocks is assigned to each of them.
+    Blocks ids of every layer are cached by the layer name together with the layer geometries object itself,
+    so another layer of the same name is assigned again. Layers should be changed by replacing the object, e.g.
+    by assigning the `geometry` array of a GeoJSON model, rather than in place.
+    """
+
+    def __init__(self, blocks: gpd.GeoDataFrame, id_column: str | None = None):
+        self.ids = (blocks.index if id_column is None else pd.Index(blocks[id_column])).to_numpy()
+        """Blocks ids in the tree order"""
+        self.tree = shapely.STRtree(blocks.geometry.to_numpy())
+        """Tree of the blocks geometries"""
+        self._blocks_ids: dict[str, tuple[gpd.GeoSeries | np.ndarray, pd.Series]] = {}
+        self._cache_info = CacheInfo()
+
+    def get_blocks_ids(self, layers: dict[str, gpd.GeoSeries | np.ndarray]) -> dict[str, pd.Series]:
+        """
+        Get blocks ids of the layers geometries.
+
+        Attributes
+        ----------
+        layers: dict[str, gpd.GeoSeries | np.ndarray]
+            Geometries by the layers names
+
+        Returns
+        -------
+        blocks_ids: dict[str, pd.Series]
+            Blocks ids by the layers names, indexed by positions of the intersecting geometries in the layer.
+            Geometries outside the blocks are missing, geometries on the blocks borders are repeated
+        """
+
+        # layers are kept in the cache, so their ids can not be reused by other objects
+        missing = {
+            name: geometry
+            for name, geometry in layers.items()
+            if name not in self._blocks_ids or self._blocks_ids[name][0] is not geometry
+        }
+        self._cache_info.hits += len(layers) - len(missing)
+        self._cache_info.misses += len(missing)
+        if len(missing) > 0:
+            geometries = [np.asarray(geometry) for geometry in missing.values()]
+            offsets = np.cumsum([0] + [len(geometry) for geometry in geometries])
+            positions, blocks = self.tree.query(np.concatenate(geometries), predicate="intersects")
+            # pairs are sorted by the queried geometries, so every layer is a contiguous slice
+            order = np.argsort(positions, kind="stable")
+            positions, blocks = positions[order], blocks[order]
+            bounds = np.searchsorted(positions, offsets)
+            for name, start, end, offset in zip(missing, bounds[:-1], bounds[1:], offsets[:-1]):
+                blocks_ids = pd.Series(
+                    self.ids[blocks[start:end]], index=positions[start:end] - offset, name="block_id"
+                )
+                self._blocks_ids[name] = (missing[name], blocks_ids)
+        return {name: self._blocks_ids[name][1] for name in layers}
+
+    def cache_info(self) -> CacheInfo:
+        """Get layers blocks ids cache usage statistics"""
+        return self._cache_info.model_copy()
@@ -0,0 +1,13 @@
+"""
+Cache statistics model shared by cached blocksnet objects is located here.
+"""
+from pydantic import BaseModel
+
+
+class CacheInfo(BaseModel):
+    """Cache usage statistics"""
+
+    hits: int = 0
+    """Number of requests served from the cache"""
+    misses: int = 0
+    """Number of requests which required the value to be built"""
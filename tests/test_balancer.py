@@ -1,5 +1,7 @@
+import numpy as np
 import pytest
 from blocksnet.method.balancing import MasterPlan
+from blocksnet.method.balancing.balancer import kindergarten_area, school_area
 
 
 @pytest.fixture
@@ -75,3 +77,44 @@ def test_schools_capacity(test_solution, test_block_params):
     assert (
         test_solution["population"] * test_block_params["shoolkids_ratio"] - test_solution["schools_capacity"]
     ) < test_block_params["shoolkids_requirement"]
+
+
+@pytest.mark.parametrize(
+    "area,number,expected",
+    [
+        (kindergarten_area, -300, (0, 0)),
+        (kindergarten_area, 140, (0, 0)),
+        (kindergarten_area, 140.2, (0.72, 180)),
+        (kindergarten_area, 141, (0.72, 180)),
+        (kindergarten_area, 181, (1.44, 250)),
+        (kindergarten_area, 251, (1.1, 280)),
+        (kindergarten_area, 279.5, (1.1, 280)),
+        (kindergarten_area, 280, (1.1, 280)),
+        (kindergarten_area, 281, (1.1, 280)),
+        (kindergarten_area, 420, (1.1, 280)),
+        (kindergarten_area, 700, (2.2, 560)),
+        (school_area, -1200, (0, 0)),
+        (school_area, 100, (0, 0)),
+        (school_area, 100.5, (1.2, 250)),
+        (school_area, 101, (1.2, 250)),
+        (school_area, 801, (1.8, 1100)),
+        (school_area, 1100, (1.8, 1100)),
+        (school_area, 1100.5, (1.8, 1100)),
+        (school_area, 1101, (1.8, 1100)),
+        (school_area, 1350, (3.0, 1350)),
+        (school_area, 2999.2, (5.1, 3000)),
+    ],
+)
+def test_area_functions(area, number, expected):
+    assert area(number) == pytest.approx(expected)
+    areas, capacities = area(np.array([number, 0]))
+    assert (areas[0], capacities[0]) == area(number)
+
+
+def test_batch_evaluation(test_block):
+    mp = MasterPlan(area=test_block["area"], current_unprov_schoolkids=300, current_unprov_kids=200)
+    mp.bnds_and_cons()
+    x = np.array([[0, 1000, 5000, 20000], [mp.b_min, mp.b_max, mp.b_min, mp.b_max], [mp.G_min, mp.G_max] * 2])
+    assert np.array_equal(mp.fun(x), [mp.fun(point) for point in x.T])
+    assert np.array_equal(mp.cons_fun(x), np.column_stack([mp.cons_fun(point) for point in x.T]))
+    assert mp.cons_jac(x[:, 1]).shape == (5, 3)
@@ -1,11 +1,18 @@
 """Testing blocks cutter behavior"""
 
+import gc
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from blocksnet.models import CityModel
-from blocksnet.method.provision import LpProvision, ProvisionModel
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from blocksnet.models import AccessibilityMatrix, CityModel, ServicesGraph
+from blocksnet.method.provision import LpProvision, ProvisionModel, ProvisionSession
 
 data_path = "./tests/data/city_model"
 local_crs = 32636
@@ -59,12 +66,89 @@ def test_matrix(city_model):
     assert (blocks.index == blocks["block_id"]).all()
 
 
+def test_matrix_persistence(city_model, accessibility_matrix, tmp_path):
+    matrix = city_model.accessibility_matrix
+    assert matrix.values.dtype == np.float32
+    matrix.save(tmp_path)
+    loaded = AccessibilityMatrix.load(tmp_path, mmap=True)
+    assert isinstance(loaded.values, np.memmap)
+    assert (loaded.df == matrix.df).all().all()
+    deciminutes = AccessibilityMatrix.from_df(accessibility_matrix, dtype=np.uint16)
+    assert np.allclose(deciminutes.df, accessibility_matrix, atol=0.05)
+
+
+def test_city_model_persistence(city_model, tmp_path):
+    city_model.save(tmp_path)
+    loaded = CityModel.load(tmp_path, mmap=True)
+    assert isinstance(loaded.accessibility_matrix.values, np.memmap)
+    assert loaded.blocks.to_gdf().equals(city_model.blocks.to_gdf())
+    assert loaded.get_service_types() == city_model.get_service_types()
+    assert loaded.services["schools"].to_gdf().equals(city_model.services["schools"].to_gdf())
+    assert sorted(loaded._graphs) == sorted(city_model.get_service_types())
+    graph = loaded.get_service_graph("schools")
+    assert (graph.adjacency != city_model.get_service_graph("schools").adjacency).nnz == 0
+    assert graph.attributes.equals(city_model.get_service_graph("schools").attributes)
+    prov = ProvisionModel(city_model=city_model, service_name="schools").run()
+    assert ProvisionModel(city_model=loaded, service_name="schools").run().equals(prov)
+
+
+def test_sparse_matrix(aggr_blocks, accessibility_matrix, services):
+    matrix = AccessibilityMatrix.from_df(accessibility_matrix, max_time=15)
+    assert matrix.values.nnz == (accessibility_matrix <= 15).sum().sum()
+    dense_model = CityModel(accessibility_matrix=accessibility_matrix, blocks=aggr_blocks, services=services)
+    sparse_model = CityModel(accessibility_matrix=matrix, blocks=aggr_blocks, services=services)
+    assert sorted(sparse_model.services_graph.nodes) == sorted(dense_model.services_graph.nodes)
+    dense_prov = ProvisionModel(city_model=dense_model, service_name="kindergartens").run()
+    sparse_prov = ProvisionModel(city_model=sparse_model, service_name="kindergartens").run()
+    assert dense_prov.drop(columns="geometry").equals(sparse_prov.drop(columns="geometry"))
+    assert 0 <= LpProvision.sum_provision(LpProvision(city_model=sparse_model).get_provision("schools")) <= 1
+    with pytest.raises(ValueError):
+        ProvisionModel(city_model=sparse_model, service_name="hospitals")
+
+
 def test_graph(city_model):
     graph = city_model.services_graph
     blocks = city_model.blocks.to_gdf()
     assert sorted(graph.nodes) == sorted(blocks.index)
 
 
+def test_graph_attributes(city_model):
+    graph = city_model.services_graph
+    nodes = pd.DataFrame.from_dict(graph.nodes, orient="index")
+    acc_mx = city_model.accessibility_matrix.df
+    for service_type in city_model.get_service_types():
+        service_ids = nodes.index[nodes[f"is_{service_type}_service"] == 1]
+        assert nodes.loc[service_ids, f"{service_type}_capacity"].gt(0).all()
+        assert (nodes.loc[nodes.index.difference(service_ids), f"{service_type}_capacity"] == 0).all()
+        assert nodes.loc[nodes["is_living"], f"population_unprov_{service_type}"].equals(
+            nodes.loc[nodes["is_living"], "population"]
+        )
+    u, v, weight = next(iter(graph.edges(data="weight")))
+    assert weight == round(float(acc_mx.loc[u, v]), 1) or weight == round(float(acc_mx.loc[v, u]), 1)
+
+
+def test_graph_view(city_model):
+    graph = city_model.graph
+    assert graph.adjacency.dtype == np.float32
+    assert (graph.adjacency != graph.adjacency.T).nnz == 0
+    restored = ServicesGraph.from_networkx(city_model.services_graph)
+    assert (restored.nodes == graph.nodes).all()
+    assert (restored.adjacency != graph.adjacency).nnz == 0
+    pd.testing.assert_frame_equal(restored.attributes, graph.attributes, check_dtype=False)
+
+
+def test_lazy_graph(city_model):
+    assert city_model._graphs == {}
+    schools_graph = city_model.get_service_graph("schools")
+    assert list(city_model._graphs) == ["schools"]
+    assert city_model.get_service_graph("schools") is schools_graph
+    assert "kindergartens_capacity" not in schools_graph.attributes
+    city_model.warm()
+    assert sorted(city_model._graphs) == sorted(city_model.get_service_types())
+    city_model.graph = city_model.graph
+    assert (city_model.get_service_graph("schools").adjacency != schools_graph.adjacency).nnz == 0
+
+
 def test_lp_provision(city_model, scenario, updated_blocks_services, updated_blocks_population):
     lpp = LpProvision(city_model=city_model)
     _, mean = lpp.get_scenario_provisions(scenario)
@@ -74,6 +158,213 @@ def test_lp_provision(city_model, scenario, updated_blocks_services, updated_blo
     assert mean >= populationMean
 
 
+def test_highs_lp_provision(city_model, updated_blocks_services):
+    for service_type in city_model.get_service_types():
+        cbc_prov = LpProvision(city_model=city_model).get_provision(service_type, updated_blocks_services)
+        highs_prov = LpProvision(city_model=city_model, engine="highs").get_provision(
+            service_type, updated_blocks_services
+        )
+        assert highs_prov.index.equals(cbc_prov.index)
+        assert (highs_prov["supplied"] <= highs_prov["demand"]).all()
+        assert np.allclose(highs_prov["supplied"], highs_prov["supplied"].round())
+        assert highs_prov["supplied"].sum() >= cbc_prov["supplied"].sum()
+
+
+def test_flow_lp_provision(city_model, updated_blocks_services):
+    for service_type in city_model.get_service_types():
+        highs_prov = LpProvision(city_model=city_model, engine="highs").get_provision(
+            service_type, updated_blocks_services
+        )
+        flow_prov = LpProvision(city_model=city_model, engine="flow").get_provision(
+            service_type, updated_blocks_services
+        )
+        pd.testing.assert_frame_equal(flow_prov, highs_prov)
+
+
+def test_warm_lp_provision(city_model, updated_blocks_services, updated_blocks_population):
+    highs_lpp = LpProvision(city_model=city_model, engine="highs")
+    warm_lpp = LpProvision(city_model=city_model, engine="highs", warm_start=True)
+    for updated_blocks in ({}, updated_blocks_services, updated_blocks_population, {242: {"schools": 500}}):
+        for service_type in city_model.get_service_types():
+            highs_prov = highs_lpp.get_provision(service_type, updated_blocks)
+            warm_prov = warm_lpp.get_provision(service_type, updated_blocks)
+            assert warm_prov.index.equals(highs_prov.index)
+            assert warm_prov["supplied"].sum() == highs_prov["supplied"].sum()
+    assert sorted(warm_lpp._problems) == sorted(city_model.get_service_types())
+    warm_lpp.services = {**warm_lpp.services, "schools": {"demand": 120, "accessibility": 10}}
+    assert warm_lpp._problems == {}
+    with pytest.raises(ValueError):
+        LpProvision(city_model=city_model, warm_start=True)
+
+
+def test_lp_provision_baseline(city_model, updated_blocks_services, updated_blocks_population):
+    lpp = LpProvision(city_model=city_model, engine="highs")
+    for updated_blocks in ({}, updated_blocks_services, updated_blocks_population, {242: {"schools": 500}}, {}):
+        for service_type in city_model.get_service_types():
+            prov = lpp.get_provision(service_type, updated_blocks)
+            fresh_prov = LpProvision(city_model=city_model, engine="highs").get_provision(service_type, updated_blocks)
+            pd.testing.assert_frame_equal(prov, fresh_prov)
+    assert sorted(lpp._baselines) == sorted(city_model.get_service_types())
+    lpp.services = {**lpp.services, "schools": {"demand": 240, "accessibility": 15}}
+    assert lpp._baselines == {}
+
+
+@pytest.mark.parametrize("engine", ["highs", "flow"])
+def test_provision_session(city_model, engine):
+    lpp = LpProvision(city_model=city_model, engine=engine)
+    session = ProvisionSession(lp_provision=lpp, service_type_name="kindergartens")
+    for updated_blocks in ({218: {"kindergartens": 1000}}, {30: {"population": 1000}}, {242: {"kindergartens": 500}}):
+        previous = session.provision
+        changed, totals = session.edit(updated_blocks)
+        full_prov = lpp.get_provision("kindergartens", session.updated_blocks)
+        prov = session.provision
+        pd.testing.assert_frame_equal(prov, full_prov)
+        assert totals["supplied"] == full_prov["supplied"].sum()
+        assert totals["provision"] == LpProvision.sum_provision(full_prov)
+        unchanged = prov.index.difference(changed.index)
+        pd.testing.assert_series_equal(prov.loc[unchanged, "supplied"], previous.loc[unchanged, "supplied"])
+    assert session.updated_blocks == {
+        218: {"kindergartens": 1000},
+        30: {"population": 1000},
+        242: {"kindergartens": 500},
+    }
+    with pytest.raises(ValueError):
+        ProvisionSession(lp_provision=LpProvision(city_model=city_model), service_type_name="kindergartens")
+
+
+@pytest.mark.parametrize("engine", ["highs", "flow"])
+def test_provision_session_tied_costs(aggr_blocks, accessibility_matrix, services, engine):
+    # travel times rounded to minutes tie, the edits join and split the groups of blocks connected by accessible pairs
+    tied_model = CityModel(accessibility_matrix=accessibility_matrix.round(), blocks=aggr_blocks, services=services)
+    lpp = LpProvision(city_model=tied_model, engine=engine)
+    lpp.services = {**lpp.services, "kindergartens": {"demand": 61, "accessibility": 3}}
+    session = ProvisionSession(lp_provision=lpp, service_type_name="kindergartens")
+    for updated_blocks in (
+        {902: {"population": 1000}},
+        {1312: {"kindergartens": 500}},
+        {902: {"population": -1000}},
+        {1312: {"kindergartens": -500}},
+    ):
+        _, totals = session.edit(updated_blocks)
+        full_prov = lpp.get_provision("kindergartens", session.updated_blocks)
+        prov = session.provision
+        assert prov.index.equals(full_prov.index)
+        assert totals["supplied"] == full_prov["supplied"].sum()
+        assert (prov["supplied"] <= prov["demand"]).all()
+        # supplied demand of the tied blocks may differ, supplied demand of the groups is the same
+        _, demand, capacity = lpp.get_blocks("kindergartens", session.updated_blocks)
+        pairs = lpp.get_accessible_pairs("kindergartens", demand, capacity)
+        rows = demand.index.get_indexer(pairs["row"])
+        columns = len(demand) + capacity.index.get_indexer(pairs["column"])
+        n_nodes = len(demand) + len(capacity)
+        graph = sp.coo_matrix((np.ones(len(pairs)), (rows, columns)), shape=(n_nodes, n_nodes))
+        _, labels = connected_components(graph, directed=False)
+        groups = pd.Series(labels[: len(demand)], index=demand.index)
+        pd.testing.assert_series_equal(
+            prov["supplied"].groupby(groups).sum(), full_prov["supplied"].groupby(groups).sum(), atol=1e-6
+        )
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_parallel_lp_provision(city_model, scenario, updated_blocks_services, executor):
+    provisions, mean = LpProvision(city_model=city_model).get_scenario_provisions(scenario, updated_blocks_services)
+    with LpProvision(city_model=city_model, executor=executor, max_workers=2) as lpp:
+        parallel_provisions, parallel_mean = lpp.get_scenario_provisions(scenario, updated_blocks_services)
+        finalizer = lpp._pool[2]
+    assert lpp._pool is None and not finalizer.alive
+    assert parallel_mean == mean
+    assert list(parallel_provisions) == list(provisions)
+    for service_type, provision in provisions.items():
+        pd.testing.assert_frame_equal(parallel_provisions[service_type], provision)
+    lpp.get_scenario_provisions(scenario)
+    finalizer = lpp._pool[2]
+    del lpp
+    gc.collect()
+    assert not finalizer.alive
+
+
+@pytest.mark.parametrize("warm_start", [False, True])
+def test_threaded_lp_provision(city_model, warm_start):
+    # the updates add demand and capacity blocks, so the threads extend the shared baselines and kept flows
+    updates = [{}, {218: {"kindergartens": 1000}}, {30: {"population": 1000}}, {242: {"kindergartens": 500}}] * 4
+    lpp = LpProvision(city_model=city_model, engine="highs", warm_start=warm_start)
+    switch_interval = sys.getswitchinterval()
+    # threads are switched often, so their reads and writes interleave
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            provisions = list(executor.map(lambda blocks: lpp.get_provision("kindergartens", blocks), updates))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    for updated_blocks, provision in zip(updates, provisions):
+        expected = LpProvision(city_model=city_model, engine="highs").get_provision("kindergartens", updated_blocks)
+        assert provision.index.equals(expected.index)
+        assert provision["supplied"].sum() == expected["supplied"].sum()
+
+
+@pytest.mark.skipif("BLOCKSNET_BENCHMARK" not in os.environ, reason="benchmark, set BLOCKSNET_BENCHMARK to run")
+def test_flow_lp_provision_benchmark(city_model, scenario):
+    timings = {}
+    for engine in ("cbc", "flow"):
+        lpp = LpProvision(city_model=city_model, engine=engine)
+        lpp.get_scenario_provisions(scenario)
+        start = time.perf_counter()
+        for _ in range(3):
+            lpp.get_scenario_provisions(scenario)
+        timings[engine] = (time.perf_counter() - start) / 3
+    assert timings["flow"] < timings["cbc"], timings
+
+
+@pytest.mark.parametrize("overflow", [False, True])
+def test_array_provision(city_model, overflow):
+    greedy = ProvisionModel(city_model=city_model, service_name="schools", engine="greedy")
+    array = ProvisionModel(city_model=city_model, service_name="schools")
+    for _ in range(2):
+        pd.testing.assert_frame_equal(array.run(overflow=overflow), greedy.run(overflow=overflow))
+    assert dict(array.graph.nodes(data=True)) == dict(greedy.graph.nodes(data=True))
+
+
+@pytest.mark.parametrize("engine", ["array", "nearest"])
+def test_edited_graph_provision(city_model, engine):
+    greedy = ProvisionModel(city_model=city_model, service_name="schools", engine="greedy")
+    model = ProvisionModel(city_model=city_model, service_name="schools", engine=engine)
+    model.run()
+    greedy.run()
+    for provision in [greedy, model]:
+        node = next(node for node, data in provision.graph.nodes(data=True) if data["is_living"])
+        provision.graph.nodes[node]["population"] += 5000
+    blocks, greedy_blocks = model.run(), greedy.run()
+    assert blocks["demand_schools"].sum() == greedy_blocks["demand_schools"].sum()
+    assert blocks.loc[node, "population"] == greedy_blocks.loc[node, "population"]
+    if engine == "array":
+        pd.testing.assert_frame_equal(blocks, greedy_blocks)
+
+
+def test_nearest_provision(city_model):
+    provision = ProvisionModel(city_model=city_model, service_name="kindergartens", engine="nearest")
+    prov = provision.run()
+    allocation = provision.allocation
+    indptr, candidates, weights = allocation._get_candidates(provision.accessibility, False)
+    assert (weights <= provision.accessibility).all()
+    # blocks stay unprovided only if their accessible services have run out
+    for node in np.flatnonzero(allocation.is_living & (allocation.population_unprov > 0)):
+        assert (allocation.capacity[candidates[indptr[node] : indptr[node + 1]]] < 1).all()
+    overflow_prov = ProvisionModel(city_model=city_model, service_name="kindergartens", engine="nearest").run(True)
+    assert (overflow_prov["population_prov_kindergartens"] == prov["population_prov_kindergartens"]).all()
+    assert overflow_prov["weakly_prov_kindergartens"].sum() > 0
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+@pytest.mark.parametrize("engine", ["array", "nearest"])
+def test_run_all_provision(city_model, engine, max_workers):
+    prov = ProvisionModel.run_all(city_model, overflow=True, engine=engine, max_workers=max_workers)
+    assert isinstance(prov, gpd.GeoDataFrame)
+    for service_type in city_model.get_service_types():
+        service_prov = ProvisionModel(city_model=city_model, service_name=service_type, engine=engine).run(True)
+        columns = ["population", *(column for column in service_prov.columns if column.endswith(service_type))]
+        pd.testing.assert_frame_equal(prov[columns], service_prov[columns])
+
+
 def test_iterative_provision(city_model):
     updated_block = {"block_id": 242, "population": 0, "is_kindergartens_service": 1, "kindergartens_capacity": 500}
     provision = ProvisionModel(city_model=city_model, service_name="kindergartens")
@@ -0,0 +1,88 @@
+"""Testing columnar GeoJSON models behavior"""
+
+import os
+import pytest
+import geopandas as gpd
+from pydantic import ValidationError
+from blocksnet.models import PointGeoJSON, PolygonGeoJSON
+from blocksnet.models.city_model import CityBlockFeature, ServicesFeature
+
+data_path = "./tests/data/city_model"
+
+
+@pytest.fixture
+def aggr_blocks():
+    return gpd.read_parquet(os.path.join(data_path, "aggr_blocks.parquet"))
+
+
+@pytest.fixture
+def schools():
+    return gpd.read_parquet(os.path.join(data_path, "schools.parquet"))
+
+
+@pytest.fixture
+def blocks(aggr_blocks):
+    return PolygonGeoJSON[CityBlockFeature].from_gdf(aggr_blocks)
+
+
+def test_to_gdf(aggr_blocks, blocks):
+    """Check if GeoDataFrame is restored with schema columns and types"""
+    gdf = blocks.to_gdf()
+    assert list(gdf.columns) == ["geometry", *CityBlockFeature.model_fields.keys()]
+    assert gdf.crs.to_epsg() == aggr_blocks.crs.to_epsg()
+    assert gdf.geometry.geom_equals(aggr_blocks.geometry).all()
+    assert (gdf["block_id"] == aggr_blocks["block_id"]).all()
+    assert gdf["is_living"].dtype == bool
+
+
+def test_serialization(blocks):
+    """Check if serialized shape is GeoJSON-like and can be read back"""
+    dump = blocks.model_dump()
+    assert list(dump.keys()) == ["epsg", "features"]
+    assert len(dump["features"]) == len(blocks.properties)
+    assert dump["features"][0]["geometry"]["type"] in ("Polygon", "MultiPolygon")
+    assert list(dump["features"][0]["properties"].keys()) == list(CityBlockFeature.model_fields.keys())
+    restored = PolygonGeoJSON[CityBlockFeature].model_validate(dump)
+    assert restored.model_dump_json() == blocks.model_dump_json()
+
+
+def test_validation(aggr_blocks, schools):
+    """Check if columns and geometries are validated against the schema"""
+    invalid = schools.copy()
+    invalid.loc[0, "capacity"] = -1
+    with pytest.raises(ValidationError):
+        PointGeoJSON[ServicesFeature].from_gdf(invalid)
+    with pytest.raises(ValidationError):
+        PointGeoJSON[ServicesFeature].from_gdf(aggr_blocks.rename(columns={"area": "capacity"}))
+    with pytest.raises(ValidationError):
+        PolygonGeoJSON[CityBlockFeature].from_gdf(aggr_blocks.drop(columns=["block_id"]))
+
+
+def test_cache(blocks):
+    """Check if GeoDataFrame is cached, copied for callers and invalidated on features change"""
+    gdf = blocks.to_gdf()
+    gdf.loc[0, "current_population"] += 100
+    assert blocks.to_gdf().loc[0, "current_population"] == gdf.loc[0, "current_population"] - 100
+    assert blocks.cache_info().hits == 1 and blocks.cache_info().misses == 1
+    blocks.properties = blocks.properties.assign(area=1.0)
+    assert (blocks.to_gdf()["area"] == 1.0).all()
+    assert blocks.cache_info().misses == 2
+
+
+def test_empty_features():
+    """Check if an empty features list is validated and serialized back"""
+    empty = PointGeoJSON[ServicesFeature].model_validate({"epsg": 4326, "features": []})
+    assert list(empty.properties.columns) == list(ServicesFeature.model_fields.keys())
+    assert empty.to_gdf().empty
+    assert empty.model_dump() == {"epsg": 4326, "features": []}
+    assert PointGeoJSON[ServicesFeature].model_validate(empty.model_dump()).model_dump() == empty.model_dump()
+
+
+def test_features_cache(blocks):
+    """Check if features are built once and dropped on reassignment"""
+    features = blocks.features
+    assert len(features) == len(blocks.properties)
+    assert blocks.features[0] is features[0]
+    blocks.properties = blocks.properties.iloc[:1]
+    blocks.geometry = blocks.geometry[:1]
+    assert len(blocks.features) == 1 and blocks.features[0] is not features[0]
@@ -3,7 +3,9 @@
 import os
 import pytest
 import geopandas as gpd
-from blocksnet.preprocessing import DataGetter, AggregateParameters
+import networkx as nx
+import numpy as np
+from blocksnet.preprocessing import Accessibility, DataGetter, AggregateParameters, MatrixCache
 
 data_path = "./tests/data/preprocessing"
 local_crs = 32636
@@ -19,6 +21,18 @@ def getter(cutted_blocks):
     return DataGetter(blocks=cutted_blocks)
 
 
+@pytest.fixture
+def graph(cutted_blocks):
+    """Synthetic walk graph: a regular grid covering the blocks with 150 meters long edges"""
+    step, speed = 150, 80
+    min_x, min_y, max_x, max_y = cutted_blocks.total_bounds
+    graph = nx.grid_2d_graph(int((max_x - min_x) // step) + 2, int((max_y - min_y) // step) + 2)
+    graph = nx.MultiDiGraph(graph)
+    nx.set_node_attributes(graph, {(i, j): {"x": min_x + i * step, "y": min_y + j * step} for i, j in graph.nodes})
+    nx.set_edge_attributes(graph, step / speed, "time_min")
+    return graph
+
+
 @pytest.fixture
 def aggr_params():
     buildings = gpd.read_parquet(os.path.join(data_path, "buildings.parquet")).to_crs(local_crs)
@@ -45,6 +59,157 @@ def test_ids(aggr_blocks):
     assert (gdf.index == gdf["block_id"]).all()
 
 
+def test_sparse_matrix(cutted_blocks, graph):
+    """Check if sparse matrix keeps exactly the pairs of the dense one within max_time"""
+    dense = Accessibility(cutted_blocks, graph).get_matrix()
+    sparse = Accessibility(cutted_blocks, graph).get_matrix(max_time=10)
+    assert sparse.values.nnz == (dense <= 10).sum().sum()
+    assert np.allclose(sparse.df.where(sparse.df <= 10), dense.where(dense <= 10), equal_nan=True)
+
+
+@pytest.mark.parametrize("max_time", [10, 1000])
+def test_sparse_matrix_unconnected(cutted_blocks, graph, max_time):
+    """Check if sparse matrix fixes the unconnected blocks as the dense one does"""
+    # the first block gets the closest node which is not connected to the grid
+    point = cutted_blocks.geometry.iloc[0].representative_point()
+    graph.add_node("unconnected", x=point.x, y=point.y)
+    dense = Accessibility(cutted_blocks, graph).get_matrix()
+    sparse = Accessibility(cutted_blocks, graph).get_matrix(max_time=max_time)
+    assert (dense.iloc[0, 1:] == dense.where(dense < 500).max().max()).all()
+    assert sparse.values.nnz == (dense <= max_time).sum().sum()
+    assert np.allclose(sparse.df.where(sparse.df <= max_time), dense.where(dense <= max_time), equal_nan=True)
+
+
+def test_chunked_matrix(cutted_blocks, graph, tmp_path):
+    """Check if chunked matrix equals the in-memory one and only pending chunks are recomputed on resume"""
+    dense = Accessibility(cutted_blocks, graph).get_matrix()
+    chunked = Accessibility(cutted_blocks, graph).get_matrix_chunked(tmp_path, processes=2, chunk_size=10)
+    assert np.allclose(chunked.df, dense)
+    assert (chunked.index == dense.index).all()
+
+    progress = np.load(tmp_path / "progress.npz")
+    near_max = progress["near_max"].copy()
+    near_max[0] = np.nan
+    Accessibility._save_progress(tmp_path, progress["nodes"], 10, near_max)
+    values = np.load(tmp_path / "values.npy", mmap_mode="r+")
+    values[:] = 0
+    values.flush()
+    resumed = Accessibility(cutted_blocks, graph).get_matrix_chunked(tmp_path, processes=2, chunk_size=10)
+    assert 0 < (resumed.values != 0).sum() < (dense.to_numpy() != 0).sum()
+
+
+def test_nk_graph(cutted_blocks, graph, tmp_path):
+    """Check if parallel edges collapse to the minimum weight and converted graph is cached"""
+    multigraph = graph.copy()
+    u, v, data = next(iter(multigraph.edges(data=True)))
+    multigraph.add_edge(u, v, time_min=data["time_min"] + 1)
+    graph_nk = Accessibility(cutted_blocks, multigraph)._get_nk_graph()
+    assert graph_nk.numberOfEdges() == graph.number_of_edges()
+    nodes = list(multigraph.nodes())
+    assert graph_nk.weight(nodes.index(u), nodes.index(v)) == round(data["time_min"], 1)
+
+    dense = Accessibility(cutted_blocks, graph).get_matrix()
+    cached = Accessibility(cutted_blocks, graph, graph_cache=tmp_path).get_matrix()
+    assert (tmp_path / "graph.nkbg").exists()
+    assert np.allclose(Accessibility(cutted_blocks, graph, graph_cache=tmp_path).get_matrix(), dense)
+    assert np.allclose(cached, dense)
+
+
+def test_nk_graph_cache_changed_edges(cutted_blocks, graph, tmp_path):
+    """Check if the cached converted graph is not reused after an edge weight changes"""
+    matrix = Accessibility(cutted_blocks, graph, graph_cache=tmp_path).get_matrix()
+    new_graph = graph.copy()
+    for edge in list(new_graph.edges(keys=True))[:400]:
+        new_graph.edges[edge]["time_min"] = 0.1
+    expected = Accessibility(cutted_blocks, new_graph).get_matrix()
+    assert not np.allclose(expected, matrix)
+    assert np.allclose(Accessibility(cutted_blocks, new_graph, graph_cache=tmp_path).get_matrix(), expected)
+
+    Accessibility(cutted_blocks, graph, graph_cache=tmp_path).get_matrix()
+    updated = Accessibility(cutted_blocks, new_graph, graph_cache=tmp_path).update_matrix(matrix, graph)
+    assert np.allclose(updated, expected)
+
+
+def test_matrix_cache(cutted_blocks, graph, tmp_path):
+    """Check if matrices are taken from the cache for the same inputs and least recently used are evicted"""
+    cache = MatrixCache(path=str(tmp_path))
+    getter = DataGetter(blocks=cutted_blocks, matrix_cache=cache)
+    dense = getter.get_accessibility_matrix(graph)
+    cached = getter.get_accessibility_matrix(graph)
+    assert cache.cache_info().hits == 1 and cache.cache_info().misses == 1
+    assert np.array_equal(cached.values, dense.values) and np.array_equal(cached.index, dense.index)
+
+    sparse = getter.get_accessibility_matrix(graph, max_time=10)
+    assert (getter.get_accessibility_matrix(graph, max_time=10).values != sparse.values).nnz == 0
+    dense_file = tmp_path / f"{cache.get_key(getter.blocks.to_gdf(), graph)}.npz"
+    nx.set_edge_attributes(graph, 1.0, "time_min")
+    getter.get_accessibility_matrix(graph, max_time=10)
+    assert cache.cache_info().hits == 2 and cache.cache_info().misses == 3
+
+    cache.max_size = sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+    cache.put("new", sparse)
+    assert not dense_file.exists() and len(os.listdir(tmp_path)) == 3
+
+    graph_key = cache.get_graph_key(graph)
+    assert cache.get_key(getter.blocks.to_gdf(), None, 10, graph_key) == cache.get_key(
+        getter.blocks.to_gdf(), graph, 10
+    )
+    getter.get_accessibility_matrix(graph, max_time=10, graph_key=graph_key)
+    assert cache.cache_info().hits == 3
+    cache.max_size = 1
+    cache.put("large", sparse)
+    assert os.listdir(tmp_path) == ["large.npz"] and cache.get("large") is not None
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 7])
+def test_update_matrix(cutted_blocks, graph, chunk_size):
+    """Check if updated matrix matches the recalculated one after blocks and edges changes"""
+    matrix = Accessibility(cutted_blocks, graph).get_matrix()
+    new_graph = graph.copy()
+    edges = list(graph.edges(keys=True))
+    new_graph.edges[edges[10]]["time_min"] = 10
+    new_graph.edges[edges[200]]["time_min"] = 0.1
+    new_graph.remove_edge(*edges[300])
+    nodes = list(graph.nodes())
+    new_graph.add_edge(nodes[0], nodes[-1], time_min=1)
+    blocks = cutted_blocks.drop(index=cutted_blocks.index[:3])
+    blocks.loc[blocks.index[0], "geometry"] = cutted_blocks.geometry.iloc[0]
+
+    updated = Accessibility(blocks, new_graph).update_matrix(
+        matrix, graph, changed_blocks=[blocks.index[0]], chunk_size=chunk_size
+    )
+    recalculated = Accessibility(blocks, new_graph).get_matrix()
+    assert (updated.index == recalculated.index).all()
+    assert np.allclose(updated, recalculated)
+
+
+def test_blocks_index(getter, aggr_params, aggr_blocks):
+    """Check if blocks index assigns points as spatial join does and caches the layers"""
+    blocks = getter.blocks.to_gdf()
+    parkings = aggr_params.parkings.to_gdf()
+    blocks_index = getter._get_blocks_index()
+    blocks_ids = blocks_index.get_blocks_ids({"parkings": aggr_params.parkings.geometry})["parkings"]
+    joined = gpd.sjoin(parkings, blocks, predicate="intersects")
+    assert sorted(zip(blocks_ids.index, blocks_ids)) == sorted(
+        zip(parkings.index.get_indexer(joined.index), joined["id"])
+    )
+    assert blocks_index.cache_info().hits == 1 and blocks_index.cache_info().misses == 3
+
+
+def test_aggregate_changed_layers(cutted_blocks, aggr_params, aggr_blocks):
+    """Check if aggregation of other layers with the same getter is not affected by the cached blocks ids"""
+    buildings = aggr_params.buildings.to_gdf()
+    params = AggregateParameters(
+        buildings=buildings.iloc[: len(buildings) // 2], greenings=aggr_params.greenings, parkings=aggr_params.parkings
+    )
+    getter = DataGetter(blocks=cutted_blocks)
+    getter.aggregate_blocks_info(params=aggr_params)
+    aggregated = getter.aggregate_blocks_info(params=params).to_gdf()
+    expected = DataGetter(blocks=cutted_blocks).aggregate_blocks_info(params=params).to_gdf()
+    assert aggregated.drop(columns="geometry").equals(expected.drop(columns="geometry"))
+    assert not aggregated["current_population"].equals(aggr_blocks.to_gdf()["current_population"])
+
+
 # def test_area(aggr_blocks):
 #   gdf = aggr_blocks.to_gdf()
 #   assert (gdf['area'] >= (gdf['current_green_area'] + gdf['current_industrial_area'] + gdf['current_living_area'])).all()